@@ -0,0 +1,245 @@
+import time
+import argparse
+import numpy as np
+import columnar
+import features
+
+# replay the candlesticks saved by get_data.py through the decider's buy/sell rules, without touching the api
+# the rules are the same as strategy.buy_decisions and strategy.sell_decisions, worked out for every minute of every market
+# at once with numpy; only the bookkeeping of each market's position is a (short) python loop over the minutes where
+# something happens
+#
+# there is no real orderbook in the candlesticks, so it is simulated from them:
+#   - the best yes bid is the yes_bid close of the minute (an empty book is a bid of 0)
+#   - the price the decider buys at (the best ask in the orderbook) is the yes_ask close of the minute
+#   - a limit buy at p fills if the yes_ask low reaches p within the order's expiry (3 minutes, like client.make_request)
+#   - a limit sell at p fills if the yes_bid high reaches p within the order's expiry
+
+# how many candlesticks the model sees (the same as the decider)
+WINDOW = 59
+# limit orders expire after 180 seconds and there is a 3 minute cooldown between sells of the same position
+EXPIRY = 3
+COOLDOWN = 3
+
+
+# put each market's candlesticks back together (sorted by time, without duplicate minutes)
+# returns ticker -> dict of numpy arrays, one per field
+def load_markets(path):
+    data = columnar.load(path)
+    if 'tickers' not in data:
+        raise ValueError(f'{path} has no tickers.npy; run get_data.py again to write one')
+
+    offsets = np.asarray(data['offsets'])
+    tickers = data['tickers']
+    columns = {field: np.asarray(data[field]) for field in columnar.FIELDS}
+
+    # the index of every candlestick, grouped by ticker
+    group_of = np.repeat(np.arange(len(tickers)), np.diff(offsets))
+    market_of = tickers[group_of]
+    order = np.lexsort((columns['end_period_ts'], market_of))
+
+    markets = {}
+    names, starts = np.unique(market_of[order], return_index=True)
+    bounds = list(starts) + [len(order)]
+    for i, name in enumerate(names):
+        idx = order[bounds[i]:bounds[i + 1]]
+        ts = columns['end_period_ts'][idx]
+        # windows overlap by a minute here and there, so keep one candlestick per minute
+        keep = np.concatenate([[True], np.diff(ts) > 0])
+        markets[str(name)] = {field: column[idx[keep]] for field, column in columns.items()}
+    return markets
+
+
+# the decider's model input for every minute of one market: the last WINDOW candlesticks up to and including that minute,
+# built by features.py exactly like strategy.predict_all builds them
+def model_inputs(m, spec, ticker=''):
+    n = len(m['end_period_ts'])
+    return spec.build(m, np.zeros(n, dtype=np.int64), np.arange(1, n + 1), [features.series_of(ticker)] * n)
+
+
+# wrap a torch model as a function from a (n, channels, WINDOW) array to n predictions
+def model_predictor(model, batch_size=65536):
+    import torch
+    model.eval()
+
+    def predict(x):
+        out = []
+        with torch.inference_mode():
+            for i in range(0, len(x), batch_size):
+                out.append(model(torch.from_numpy(x[i:i + batch_size])).view(-1).numpy())
+        return np.concatenate(out) if out else np.zeros(0, dtype=np.float32)
+
+    return predict
+
+
+# for an order placed at each minute with the given price, the first minute (within the expiry) it fills at, or -1
+# reach is how far the price went during each minute (nan if there was no price) and cmp(reach, price) says whether it filled
+def _first_fill(price, reach, cmp, expiry=EXPIRY):
+    n = len(price)
+    fill_at = np.full(n, -1, dtype=np.int64)
+    # go backwards so the earliest minute that fills wins
+    for k in range(expiry, 0, -1):
+        later = np.full(n, np.nan)
+        later[:n - k] = reach[k:]
+        hit = cmp(later, price) & ~np.isnan(later)
+        fill_at[hit] = np.arange(n)[hit] + k
+    return fill_at
+
+
+def _fill_buy(price, position, cost, stats):
+    stats['buy_fills'] += 1
+    stats['contracts'] += 1
+    stats['traded_value'] += price
+    return position + 1, cost + price
+
+
+# a sell realizes the difference between its price and the average price paid for the position
+def _fill_sell(order, realized, cost, position, stats):
+    _, price, count = order
+    count = min(count, position)
+    avg = cost / position if position else 0.0
+    stats['sell_fills'] += 1
+    stats['contracts'] += count
+    stats['traded_value'] += count * price
+    return realized + count * (price - avg), cost - count * avg, position - count
+
+
+# run the decider's rules over one market
+# buy_margin / sell_margin shift the thresholds (the decider uses 0 for both)
+def simulate_market(m, pred, buy_margin=0.0, sell_margin=0.0, can_buy=True, expiry=EXPIRY, cooldown=COOLDOWN):
+    last = m['yes_bid_open']
+    bid = m['yes_bid_close']
+    ask = m['yes_ask_close']
+
+    # strategy.buy_decisions: the last bid is below the prediction, there are bids and the best ask < best bid + 2
+    # (and there is no open buy for the market, which depends on the earlier buys, so it is checked in the loop)
+    buy_signal = (last < pred - buy_margin) & (bid > 0) & (ask > 0) & (ask < bid + 2) & can_buy
+    buy_fill = _first_fill(ask, np.where(m['yes_ask_low'] > 0, m['yes_ask_low'], np.nan), np.less_equal, expiry)
+
+    # strategy.sell_decisions: the last bid is above the prediction and the book isn't empty
+    # (whether the position was bought for less than the best bid depends on the position, so it is checked in the loop)
+    sell_signal = (last > pred + sell_margin) & (bid > 0)
+    sell_fill = _first_fill(bid, np.where(m['yes_bid_high'] > 0, m['yes_bid_high'], np.nan), np.greater_equal, expiry)
+
+    # the only minutes where anything can happen
+    busy = np.flatnonzero(buy_signal | sell_signal | np.isin(np.arange(len(last)), buy_fill[buy_signal & (buy_fill >= 0)]))
+
+    position = 0
+    cost = 0.0
+    realized = 0.0
+    pending_buys = {}
+    # the minute the last buy stops being open (it filled, or it expired)
+    buy_open_until = -1
+    pending_sell = None
+    cooling_until = -1
+    stats = {'buy_orders': 0, 'buy_fills': 0, 'sell_orders': 0, 'sell_fills': 0, 'contracts': 0, 'traded_value': 0.0}
+
+    buy_signal, sell_signal = buy_signal.tolist(), sell_signal.tolist()
+    buy_fill, sell_fill, bid_l, ask_l = buy_fill.tolist(), sell_fill.tolist(), bid.tolist(), ask.tolist()
+
+    for t in busy.tolist():
+        # a sell that has filled since the last minute that was visited
+        # (the cooldown is as long as the expiry, so this always happens before the position can be sold again)
+        if pending_sell is not None and pending_sell[0] <= t:
+            realized, cost, position = _fill_sell(pending_sell, realized, cost, position, stats)
+            pending_sell = None
+
+        # buys that fill this minute
+        for price in pending_buys.pop(t, []):
+            position, cost = _fill_buy(price, position, cost, stats)
+
+        # sell: the position is held, it was bought for less than the best bid and it isn't cooling down
+        if position > 0 and sell_signal[t] and t >= cooling_until and cost / position < bid_l[t]:
+            stats['sell_orders'] += 1
+            cooling_until = t + cooldown
+            if sell_fill[t] >= 0:
+                pending_sell = (sell_fill[t], bid_l[t], position)
+
+        # buy one contract at the best ask, unless the last buy is still waiting to fill
+        if buy_signal[t] and t >= buy_open_until:
+            stats['buy_orders'] += 1
+            if buy_fill[t] >= 0:
+                pending_buys.setdefault(buy_fill[t], []).append(ask_l[t])
+                buy_open_until = buy_fill[t]
+            else:
+                buy_open_until = t + expiry
+
+    # anything still pending when the data runs out
+    if pending_sell is not None:
+        realized, cost, position = _fill_sell(pending_sell, realized, cost, position, stats)
+    for fill_t in sorted(pending_buys):
+        for price in pending_buys[fill_t]:
+            position, cost = _fill_buy(price, position, cost, stats)
+
+    # whatever is left is valued at the last best bid
+    unrealized = position * (bid_l[-1] if bid_l else 0) - cost
+    stats.update({'realized': realized, 'unrealized': unrealized, 'pnl': realized + unrealized, 'position': position})
+    return stats
+
+
+# the model's prediction for every minute of every market
+# the inputs of several markets are batched together, up to batch_rows minutes at a time
+# spec is the model's features.FeatureSpec (the inputs the old decider built if it isn't given)
+def predict_markets(markets, predict, spec=None, batch_rows=65536):
+    spec = features.legacy_spec(WINDOW) if spec is None else spec
+    preds = {}
+    names = []
+    inputs = []
+
+    def flush():
+        out = np.asarray(predict(np.concatenate(inputs)), dtype=np.float64)
+        for name, part in zip(names, np.split(out, np.cumsum([len(x) for x in inputs])[:-1])):
+            preds[name] = part
+        names.clear()
+        inputs.clear()
+
+    for name, m in markets.items():
+        names.append(name)
+        inputs.append(model_inputs(m, spec, name))
+        if sum(len(x) for x in inputs) >= batch_rows:
+            flush()
+    if inputs:
+        flush()
+    return preds
+
+
+# run the whole backtest; predict maps a (n, channels, WINDOW) array of model inputs (built with spec) to n predictions
+# (predictions can also be passed in directly, e.g. to sweep thresholds without running the model again)
+# returns the totals over every market, plus the result of each market under 'markets'
+def backtest(markets, predict=None, buy_margin=0.0, sell_margin=0.0, can_buy=True, predictions=None, spec=None):
+    started = time.perf_counter()
+    if predictions is None:
+        predictions = predict_markets(markets, predict, spec)
+    predicted = time.perf_counter()
+
+    results = {name: simulate_market(m, predictions[name], buy_margin, sell_margin, can_buy) for name, m in markets.items()}
+
+    totals = {key: sum(r[key] for r in results.values()) for key in
+              ['buy_orders', 'buy_fills', 'sell_orders', 'sell_fills', 'contracts', 'traded_value', 'realized', 'unrealized', 'pnl']}
+    orders = totals['buy_orders'] + totals['sell_orders']
+    totals['fill_rate'] = (totals['buy_fills'] + totals['sell_fills']) / orders if orders else 0.0
+    totals['minutes'] = sum(len(m['end_period_ts']) for m in markets.values())
+    totals['predict_seconds'] = predicted - started
+    totals['simulate_seconds'] = time.perf_counter() - predicted
+    totals['markets'] = results
+    return totals
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='replay saved candlesticks through the decider rules')
+    parser.add_argument('--data', default='../large_files/dataset')
+    parser.add_argument('--model', default='../large_files/model.pth')
+    parser.add_argument('--buy-margin', type=float, default=0.0)
+    parser.add_argument('--sell-margin', type=float, default=0.0)
+    args = parser.parse_args(argv)
+
+    from inference import load
+    model, spec = load(args.model)
+    report = backtest(load_markets(args.data), model_predictor(model), args.buy_margin, args.sell_margin, spec=spec)
+    report.pop('markets')
+    for key, value in report.items():
+        print(f'{key}: {value:.4f}' if isinstance(value, float) else f'{key}: {value}')
+
+
+if __name__ == '__main__':
+    main()
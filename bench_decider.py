@@ -0,0 +1,139 @@
+import os
+import sys
+import math
+import time
+import asyncio
+import argparse
+import tempfile
+import subprocess
+import mock_server
+
+# measure how long a decider cycle takes, end to end, against mock_server.py with a given number of markets
+# the decider reads the api url, the key and the model path from the environment (see config.py), so everything is
+# set up first and the decider is imported last
+#
+# the startup of the live decider (importing it and building a Decider, until it is ready to wait for its first cycle) is
+# measured first, in a fresh process so nothing is already imported; it should stay under STARTUP_LIMIT seconds
+
+STARTUP_LIMIT = 1.0
+
+# what the fresh process runs: prints the startup time, then how long until the model had loaded in the background
+STARTUP_SCRIPT = '''
+import time
+started = time.perf_counter()
+import decider
+d = decider.Decider()
+print(time.perf_counter() - started)
+d.wait_for_model()
+print(time.perf_counter() - started)
+'''
+
+def measure_startup():
+    out = subprocess.run([sys.executable, '-c', STARTUP_SCRIPT], capture_output=True, text=True, check=True,
+                         cwd=os.path.dirname(os.path.abspath(__file__)))
+    ready, model = (float(line) for line in out.stdout.split()[-2:])
+    return ready, model
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p / 100 * len(values)))] if values else 0.0
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmark the decider against a mock api')
+    parser.add_argument('--markets', type=int, default=60, help='the total number of markets across the traded events')
+    parser.add_argument('--events', type=int, default=6, help='how many series the decider trades (each has an event today and tomorrow)')
+    parser.add_argument('--cycles', type=int, default=5)
+    parser.add_argument('--latency', type=float, default=0.02, help='seconds added to every mock response')
+    parser.add_argument('--jitter', type=float, default=0.01)
+    parser.add_argument('--p429', type=float, default=0.0)
+    parser.add_argument('--p5xx', type=float, default=0.0)
+    parser.add_argument('--orders', type=int, default=20, help='how many orders to place directly to measure order latency')
+    parser.add_argument('--metrics', help='write every metric recorded during the run here (.prom for Prometheus text, else json)')
+    parser.add_argument('--shards', type=int, default=0, help='benchmark the sharded decider with this many worker processes')
+    parser.add_argument('--profile', help='run the cycles under cProfile and save the stats here')
+    args = parser.parse_args()
+
+    server = mock_server.MockKalshi(mock_server.generate_fixtures([]), latency=args.latency, jitter=args.jitter,
+                                    p429=args.p429, p5xx=args.p5xx, auto_markets=math.ceil(args.markets / args.events / 2))
+    os.environ['KALSHI_BASE_URL'] = server.start()
+    os.environ['KALSHI_SERIES'] = ','.join(f'KXBENCH{i}' for i in range(args.events))
+    tmp = tempfile.mkdtemp()
+
+    # the mock api doesn't check signatures, so any key will do
+    if not os.getenv('PROD_KEYFILE'):
+        from cryptography.hazmat.primitives import serialization
+        from cryptography.hazmat.primitives.asymmetric import rsa
+        key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        os.environ['PROD_KEYFILE'] = os.path.join(tmp, 'key.pem')
+        os.environ['PROD_KEYID'] = 'bench'
+        with open(os.environ['PROD_KEYFILE'], 'wb') as f:
+            f.write(key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()))
+
+    # an untrained model is just as fast as a trained one
+    if not os.path.exists(os.getenv('KALSHI_MODEL_PATH', '../large_files/model.pth')):
+        from nn import KalshiCNN
+        from inference import save_artifact
+        from features import FeatureSpec
+        os.environ['KALSHI_MODEL_PATH'] = os.path.join(tmp, 'model.pth')
+        spec = FeatureSpec()
+        save_artifact(KalshiCNN(59, len(spec)), os.environ['KALSHI_MODEL_PATH'], 59, features=spec)
+
+    ready, model = measure_startup()
+    print(f'decider startup: {ready:.3f}s{" (over the " + str(STARTUP_LIMIT) + "s limit)" if ready > STARTUP_LIMIT else ""}, '
+          f'model loaded after {model:.2f}s')
+
+    import metrics
+    from snapshot import traded_markets
+    started = time.perf_counter()
+    if args.shards:
+        # the sharded decider: the coordinator starts the worker processes
+        import sharded
+        coordinator = sharded.Coordinator(args.shards)
+        run_cycle, orders, client = coordinator.run_cycle, coordinator.orders, coordinator.client
+        print(f'coordinator start: {time.perf_counter() - started:.2f}s')
+    else:
+        import decider
+        bot = decider.Decider()
+        # the cycles are timed without the model load (the live decider loads it while it waits for the first cycle)
+        bot.wait_for_model()
+        run_cycle, orders, client = (lambda: asyncio.run(bot.run_cycle())), bot.orders, bot.client
+        print(f'decider start: {time.perf_counter() - started:.2f}s')
+
+    cycle_times = []
+    for _ in range(args.cycles):
+        start = time.perf_counter()
+        with metrics.span('cycle'), metrics.profile(args.profile):
+            run_cycle()
+        cycle_times.append(time.perf_counter() - start)
+
+    # the decider only places orders when the model says so, so order placement is also measured on its own
+    import fetcher
+    from universe import MarketUniverse
+    tickers = [ticker for _, ticker in traded_markets(MarketUniverse(fetcher.make_session()).events())]
+    # (one at a time, then all in one batch)
+    for i in range(args.orders):
+        orders.place(tickers[i % len(tickers)], 'buy', 50, count=1)
+    started = time.perf_counter()
+    orders.place_many([(tickers[i % len(tickers)], 'buy', 50, 1) for i in range(args.orders)])
+    batch_time = time.perf_counter() - started
+    orders.reconcile()
+
+    print(f'{len(tickers)} markets, {server.requests} requests, {len(server.orders)} orders {orders.summary()}')
+    print(f'cycle: p50 {percentile(cycle_times, 50):.3f}s, p95 {percentile(cycle_times, 95):.3f}s, max {max(cycle_times):.3f}s')
+    print(f'batch of {args.orders} orders: {batch_time:.3f}s')
+    for path, stats in client.latency_stats().items():
+        print(f'{path}: {stats["requests"]} calls, p50 {stats["p50"] * 1000:.0f}ms, p95 {stats["p95"] * 1000:.0f}ms, p99 {stats["p99"] * 1000:.0f}ms')
+
+    # where the time of a cycle goes
+    for name, h in sorted(metrics.snapshot()['histograms'].items()):
+        if not name.startswith('http_'):
+            print(f'{name}: {h["count"]} x, mean {h["mean"] * 1000:.1f}ms, p95 <= {h["p95"] * 1000:.1f}ms')
+    if args.metrics:
+        metrics.write(args.metrics)
+
+    if args.shards:
+        coordinator.stop()
+    server.stop()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,147 @@
+import time
+import threading
+import numpy as np
+from columnar import FIELDS, get_value
+
+# live candlesticks for the decider, kept in a fixed-size ring buffer per market
+# instead of pulling 8 hours of candlesticks every minute and throwing away all but the last 59, each buffer only
+# asks for the minutes since its last candlestick and writes them over the oldest ones in place
+# the rest of the decider reads the candlesticks as arrays (array() / to_array), one row per minute and one column per
+# field of columnar.FIELDS, so they are never turned back into dicts
+
+COLUMNS = list(FIELDS)
+TS = COLUMNS.index('end_period_ts')
+
+
+# a list of api candlestick dicts as a (candlesticks, fields) array, in the same layout as CandleBuffer.array()
+def to_array(candles):
+    return np.array([[get_value(c, FIELDS[f]) for f in COLUMNS] for c in candles], dtype=np.float64).reshape(-1, len(COLUMNS))
+
+
+class CandleBuffer:
+    def __init__(self, size=59):
+        self.size = size
+        # one row per candlestick, one column per field in columnar.FIELDS (float64 so the timestamps stay exact)
+        self.data = np.zeros((size, len(COLUMNS)), dtype=np.float64)
+        # where the next candlestick will be written, and how many candlesticks are held
+        self.head = 0
+        self.count = 0
+        # a streaming feed can push from another thread while the decider reads
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return self.count
+
+    # the end_period_ts of the newest candlestick (None if the buffer is empty)
+    @property
+    def last_ts(self):
+        if self.count == 0:
+            return None
+        return int(self.data[(self.head - 1) % self.size, TS])
+
+    # add one candlestick (an api candlestick dict); this is also the entry point for a streaming feed
+    def push(self, candle):
+        row = [get_value(candle, FIELDS[c]) for c in COLUMNS]
+        with self.lock:
+            last_ts = self.last_ts
+
+            # the current minute can be sent again with updated values, so it replaces the newest row
+            if last_ts is not None and row[TS] == last_ts:
+                self.data[(self.head - 1) % self.size] = row
+                return
+            # anything older than what is already held is ignored
+            if last_ts is not None and row[TS] < last_ts:
+                return
+
+            self.data[self.head] = row
+            self.head = (self.head + 1) % self.size
+            self.count = min(self.count + 1, self.size)
+
+    def extend(self, candles):
+        for candle in candles:
+            self.push(candle)
+
+    # the held candlesticks, oldest first, as a (count, fields) array
+    def array(self):
+        with self.lock:
+            if self.count < self.size:
+                return self.data[:self.count].copy()
+            return np.concatenate([self.data[self.head:], self.data[:self.head]])
+
+
+
+# a buffer for every market the decider trades
+class CandleBuffers:
+    def __init__(self, size=59, lookback=14400 * 2):
+        self.size = size
+        # how far back to look for a market that has no candlesticks yet
+        self.lookback = lookback
+        self.buffers = {}
+
+    def __getitem__(self, ticker):
+        if ticker not in self.buffers:
+            self.buffers[ticker] = CandleBuffer(self.size)
+        return self.buffers[ticker]
+
+    def __contains__(self, ticker):
+        return ticker in self.buffers and len(self.buffers[ticker]) > 0
+
+    # the start_ts to ask the api for: just the minutes since the newest candlestick (including it, in case it changed)
+    def start_ts(self, ticker, now=None):
+        now = int(time.time()) if now is None else now
+        last_ts = self[ticker].last_ts
+        if last_ts is None:
+            return now - self.lookback
+        return max(now - self.lookback, last_ts - 60)
+
+    def push(self, ticker, candle):
+        self[ticker].push(candle)
+
+    # forget every market that isn't in tickers (e.g. yesterday's markets, once the universe has rolled over)
+    def retain(self, tickers):
+        tickers = set(tickers)
+        self.buffers = {ticker: buffer for ticker, buffer in self.buffers.items() if ticker in tickers}
+
+    # ticker -> (candlesticks, fields) array for every market with data (what the rest of the decider works with)
+    def arrays(self):
+        return {ticker: buffer.array() for ticker, buffer in self.buffers.items() if len(buffer) > 0}
+
+
+# a local stand-in for a websocket candlestick feed, used for testing
+# candles maps ticker -> list of candlestick dicts; run() pushes them to every subscriber in end_period_ts order,
+# waiting interval seconds between minutes (0 replays everything as fast as possible)
+class LocalFeed:
+    def __init__(self, candles, interval=0):
+        self.candles = candles
+        self.interval = interval
+        self.subscribers = []
+        self.stopped = threading.Event()
+
+    def subscribe(self, callback):
+        self.subscribers.append(callback)
+
+    # subscribe a set of buffers, so the feed writes straight into them
+    def attach(self, buffers):
+        self.subscribe(buffers.push)
+
+    def run(self):
+        events = sorted(((c['end_period_ts'], ticker, c) for ticker, candles in self.candles.items() for c in candles),
+                        key=lambda e: (e[0], e[1]))
+        last_ts = None
+        for ts, ticker, candle in events:
+            if self.stopped.is_set():
+                return
+            if self.interval and last_ts is not None and ts != last_ts:
+                time.sleep(self.interval)
+            last_ts = ts
+            for callback in self.subscribers:
+                callback(ticker, candle)
+
+    # run the feed in a background thread
+    def start(self):
+        thread = threading.Thread(target=self.run, daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self):
+        self.stopped.set()
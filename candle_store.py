@@ -0,0 +1,47 @@
+import sqlite3
+import json
+import time
+
+# a local sqlite store for everything get_data.py downloads, so a re-run only fetches what it doesn't already have
+# windows are keyed by (series_ticker, ticker, start_ts), where start_ts is the start of a 100 minute window
+# a window is only marked complete once its end_ts is in the past, so the last (partial) window is fetched again next run
+class CandleStore:
+    def __init__(self, path='candles.db'):
+        self.conn = sqlite3.connect(path)
+        # WAL keeps the file consistent if the backfill crashes part way through a write
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS windows (
+                series_ticker TEXT NOT NULL,
+                ticker        TEXT NOT NULL,
+                start_ts      INTEGER NOT NULL,
+                end_ts        INTEGER NOT NULL,
+                complete      INTEGER NOT NULL,
+                fetched_at    INTEGER NOT NULL,
+                candlesticks  TEXT NOT NULL,
+                PRIMARY KEY (series_ticker, ticker, start_ts)
+            )''')
+        self.conn.commit()
+
+    # the start_ts of every window of a market that doesn't need to be fetched again
+    def complete_windows(self, series_ticker, ticker):
+        rows = self.conn.execute('SELECT start_ts FROM windows WHERE series_ticker = ? AND ticker = ? AND complete = 1',
+                                 (series_ticker, ticker))
+        return {row[0] for row in rows}
+
+    # rows are (series_ticker, ticker, start_ts, end_ts, candlesticks); they are written in one transaction
+    def put_windows(self, rows, fetched_at=None):
+        fetched_at = int(time.time()) if fetched_at is None else fetched_at
+        with self.conn:
+            self.conn.executemany('INSERT OR REPLACE INTO windows VALUES (?, ?, ?, ?, ?, ?, ?)', [
+                (series_ticker, ticker, start_ts, end_ts, int(end_ts <= fetched_at), fetched_at, json.dumps(candlesticks))
+                for series_ticker, ticker, start_ts, end_ts, candlesticks in rows
+            ])
+
+    def get_window(self, series_ticker, ticker, start_ts):
+        row = self.conn.execute('SELECT candlesticks FROM windows WHERE series_ticker = ? AND ticker = ? AND start_ts = ?',
+                                (series_ticker, ticker, start_ts)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def close(self):
+        self.conn.close()
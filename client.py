@@ -1,107 +1,245 @@
-import time, os, json, base64, requests
+import time, os, base64
 from dotenv import load_dotenv
 from cryptography.hazmat.primitives import hashes, serialization
 from cryptography.hazmat.primitives.asymmetric import padding, rsa
-import random
+import threading
+from dataclasses import dataclass
+from concurrent.futures import ThreadPoolExecutor
+import fetcher
+import metrics
+import config
+
+# a position you currently own
+@dataclass
+class Holding:
+    ticker: str
+    # how many contracts are held
+    posn: int
+    # how much was paid per contract
+    price: int
+    # the current value of a contract (the market's yes_bid), None if it couldn't be looked up
+    value: int
+
+# makes client_order_ids that never repeat, however fast orders are placed and from however many threads or processes
+# an id is <process prefix>-<counter>: the prefix is the process id plus random bits (made again in a forked child), and
+# the counter starts at the current time in microseconds and always goes up by at least one, so the ids of a process
+# are increasing and unique even across restarts
+class OrderIds:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.last = 0
+        self._new_prefix()
+        os.register_at_fork(after_in_child=self._new_prefix)
+
+    def _new_prefix(self):
+        self.prefix = f'{os.getpid():x}{os.urandom(3).hex()}'
+
+    def next(self):
+        with self.lock:
+            self.last = max(self.last + 1, time.time_ns() // 1000)
+            return f'{self.prefix}-{self.last:x}'
+
+# the one generator every Client shares (it registers a fork hook, so it is only ever made once per process)
+ORDER_IDS = OrderIds()
 
 # code for making api calls - a lot of this comes from the Kalshi API documentation
 # I will comment and explain the code that is critical to understanding the bot
 class Client:
-    def __init__(self):
+    def __init__(self, timeout=10, pool_size=10):
         load_dotenv()
         # set your environment variables (more information can be found online and on the Kalshi website)
         self.KEY_ID = os.getenv("PROD_KEYID")
         self.KEY_FILE = os.getenv("PROD_KEYFILE")
 
+        # the key is read and parsed once here instead of on every request
+        # (every call the client makes is signed, so there is no point in starting without one)
+        if not self.KEY_FILE:
+            raise RuntimeError('PROD_KEYFILE is not set; point it at your Kalshi api private key (see .env)')
+        self.private_key = self.load_key(self.KEY_FILE)
+        self._pss = padding.PSS(mgf=padding.MGF1(hashes.SHA256()), salt_length=padding.PSS.DIGEST_LENGTH)
+
+        # every call goes over the same keep-alive session, so orders don't pay for a new TCP+TLS handshake
+        # (the session only retries GETs on server errors, orders are never sent twice)
+        self.timeout = timeout
+        self.session = fetcher.make_session(pool_size=pool_size)
+
+        # path -> latency stats for every call made by the client
+        self.latency = {}
+
+        # where client_order_ids come from, and how many orders place_orders sends at once
+        self.order_ids = ORDER_IDS
+        self.pool_size = pool_size
+
     def load_key(self, path) -> rsa.RSAPrivateKey:
         with open(path, "rb") as f:
             return serialization.load_pem_private_key(f.read(), None)
 
     def sign(self, privkey, msg: str) -> str:
-        sig = privkey.sign(
-            msg.encode(),
-            padding.PSS(mgf=padding.MGF1(hashes.SHA256()),
-                        salt_length=padding.PSS.DIGEST_LENGTH),
-            hashes.SHA256(),
-        )
+        sig = privkey.sign(msg.encode(), self._pss, hashes.SHA256())
         return base64.b64encode(sig).decode()
 
-    # make the api call to buy or sell
-    def make_request(self, ticker, action, yes_price, count=1):
-        priv = self.load_key(self.KEY_FILE)
-
-        method = "POST"
-        path   = "/trade-api/v2/portfolio/orders"
-
+    # the headers for an authenticated call, signed with the cached key
+    def auth_headers(self, method, path):
         # get the current timestamp (getting rid of milliseconds)
         ts     = str(int(time.time()*1000))
         msg    = ts + method + path
 
-        headers = {
+        return {
             "KALSHI-ACCESS-KEY":       self.KEY_ID,
-            "KALSHI-ACCESS-SIGNATURE": self.sign(priv, msg),
+            "KALSHI-ACCESS-SIGNATURE": self.sign(self.private_key, msg),
             "KALSHI-ACCESS-TIMESTAMP": ts,
             "Content-Type":            "application/json",
             "accept":                  "application/json"
         }
 
-        # generate a random id for the order, a new id needs to be used for each order, so if an order
-        # is placed at the same second as another order, the random number will ensure that the ids are different
-        id = str(int(time.time())) + str(random.randint(1, 1000))
-
-        # place a limit order buy at the price of the last bid (hoping there is an offer at that price), expires in 3 minutes
-        if action == 'buy':
-            body = {
-                "action": action,
-                "count" : count,
-                "side"  : "yes",
-                "ticker": ticker,
-                "type"  : "limit",
-                "yes_price": yes_price,
-                "client_order_id": id,
-                "expiration_ts": int(time.time()) + 180
-            }
-
-        # place a limit order sell at the last bid for the contract, expires in 3 minutes
-        elif action == 'sell':
-            body = {
-                "action": action,
-                "count" : count,
-                "side"  : "yes",
-                "ticker": ticker,
-                "type"  : "limit",
-                "yes_price": int(yes_price),
-                "client_order_id": id,
-                "expiration_ts": int(time.time()) + 180
-            }
+    # send a request over the pooled session and record how long it took
+    def _send(self, method, path, stats_key=None, **kwargs):
+        stats_key = stats_key or path
+        if stats_key not in self.latency:
+            self.latency[stats_key] = fetcher.FetchStats()
+
+        endpoint = metrics.endpoint(path)
+        start = time.monotonic()
+        try:
+            r = self.session.request(method, config.BASE_URL + path, timeout=self.timeout, **kwargs)
+        except Exception:
+            metrics.inc('http_errors_total', endpoint=endpoint, method=method)
+            raise
+        latency = time.monotonic() - start
+        self.latency[stats_key].record(latency)
+        metrics.observe('http_request_seconds', latency, endpoint=endpoint, method=method)
+        metrics.inc('http_responses_total', endpoint=endpoint, method=method, status=r.status_code)
+        return r
+
+    # a summary (count, p50, p95, p99...) of the latency of every endpoint the client has called
+    def latency_stats(self):
+        return {path: stats.summary() for path, stats in self.latency.items()}
+
+    # a new id needs to be used for each order (see OrderIds)
+    def new_order_id(self):
+        return self.order_ids.next()
+
+    # the body of an order
+    # a limit order buy at the price of the last bid (hoping there is an offer at that price), or a limit order sell at the
+    # last bid for the contract, both expiring in 3 minutes
+    def order_body(self, ticker, action, yes_price, count=1, client_order_id=None):
+        if action not in ('buy', 'sell'):
+            raise ValueError(f'unknown action {action}')
+        return {
+            "action": action,
+            "count" : count,
+            "side"  : "yes",
+            "ticker": ticker,
+            "type"  : "limit",
+            "yes_price": int(yes_price),
+            "client_order_id": client_order_id or self.new_order_id(),
+            "expiration_ts": int(time.time()) + 180
+        }
+
+    # make the api call to buy or sell
+    # (client_order_id is the id to send with the order, so the caller can track it; a new one is made if it isn't given)
+    def make_request(self, ticker, action, yes_price, count=1, client_order_id=None):
+        method = "POST"
+        path   = "/trade-api/v2/portfolio/orders"
+
+        headers = self.auth_headers(method, path)
+        body = self.order_body(ticker, action, yes_price, count, client_order_id)
 
         # make the api call
-        r = requests.post("https://api.elections.kalshi.com" + path, headers=headers, json=body)
+        r = self._send(method, path, headers=headers, json=body)
 
         return r.status_code, r.text
-    
+
+    # place many orders at once, each on its own pooled connection, instead of one blocking POST after another
+    # orders is a list of (ticker, action, yes_price, count, client_order_id) (client_order_id can be None)
+    # returns the (status code, text) of every order, in the same order; an order that couldn't be sent at all gets
+    # (None, the error) rather than stopping the others
+    def place_orders(self, orders, max_workers=None):
+        def place(order):
+            try:
+                return self.make_request(*order[:4], client_order_id=order[4] if len(order) > 4 else None)
+            except Exception as e:
+                return None, str(e)
+
+        if len(orders) <= 1:
+            return [place(order) for order in orders]
+        with ThreadPoolExecutor(max_workers or min(len(orders), self.pool_size)) as pool:
+            return list(pool.map(place, orders))
+
+    # get the current yes_bid of many markets at once, with one /markets call per 100 tickers
+    # anything a bulk call didn't return (or all of it, if the call failed, e.g. with a 429) is looked up on its own, all
+    # at once through fetcher.fetch_all (which backs off on 429s); a ticker that still can't be found is left out
+    def get_prices(self, tickers):
+        prices = {}
+        tickers = list(tickers)
+        for i in range(0, len(tickers), 100):
+            chunk = tickers[i:i + 100]
+            r = self._send("GET", "/trade-api/v2/markets", params={"tickers": ",".join(chunk), "limit": len(chunk)})
+            if r.status_code == 200:
+                markets = {m['ticker']: m for m in r.json().get('markets', [])}
+            else:
+                print(f'getting the prices of {len(chunk)} markets failed ({r.status_code}), looking them up one by one')
+                markets = {}
+            prices.update({ticker: markets[ticker]['yes_bid'] for ticker in chunk if ticker in markets})
+
+            missing = [ticker for ticker in chunk if ticker not in markets]
+            if missing:
+                stats_key = "/trade-api/v2/markets/{ticker}"
+                stats = self.latency.setdefault(stats_key, fetcher.FetchStats())
+                urls = [f'{config.BASE_URL}/trade-api/v2/markets/{ticker}' for ticker in missing]
+                results, _ = fetcher.fetch_all(self.session, urls, max_workers=min(len(urls), self.pool_size), stats=stats, timeout=self.timeout)
+                for ticker, result in zip(missing, results):
+                    if result is not None and 'market' in result:
+                        prices[ticker] = result['market']['yes_bid']
+                    else:
+                        print(f'could not get the price of {ticker}')
+
+        return prices
+
+    # every order placed since min_ts (optionally only the ones with the given status), following the cursor
+    def get_orders(self, min_ts=None, status=None):
+        method = "GET"
+        path   = "/trade-api/v2/portfolio/orders"
+
+        params = {"limit": 1000}
+        if min_ts is not None:
+            params["min_ts"] = min_ts
+        if status is not None:
+            params["status"] = status
+
+        orders = []
+        while True:
+            r = self._send(method, path, stats_key="GET " + path, headers=self.auth_headers(method, path), params=params).json()
+            orders.extend(r.get('orders', []))
+            if not r.get('cursor'):
+                return orders
+            params["cursor"] = r['cursor']
+
     # get the positions you currently own
-    def get_positions(self):
+    # the open positions as the api lists them (the ones that have gone back to 0 are left out)
+    def fetch_positions(self):
         method = "GET"
         path   = "/trade-api/v2/portfolio/positions"
-        ts     = str(int(time.time()*1000))
-        msg    = ts + method + path
 
-        priv = self.load_key(self.KEY_FILE)
-        headers = {
-            "KALSHI-ACCESS-KEY":       self.KEY_ID,
-            "KALSHI-ACCESS-SIGNATURE": self.sign(priv, msg),
-            "KALSHI-ACCESS-TIMESTAMP": ts,
-            "Content-Type":            "application/json",
-            "accept":                  "application/json"
-        }
+        headers = self.auth_headers(method, path)
 
-        positions = requests.get('https://api.elections.kalshi.com/trade-api/v2/portfolio/positions', headers = headers)
+        positions = self._send(method, path, headers=headers)
+        return [mp for mp in positions.json()['market_positions'] if mp["position"] != 0]
+
+    # turn positions into Holdings
+    # markets is ticker -> market record for markets that were just fetched anyway (e.g. the decider's snapshot); only the
+    # positions that aren't in it have their current value looked up, in one go instead of one call per position
+    def to_holdings(self, market_positions, markets=None):
+        markets = markets or {}
+        prices = {t: m['yes_bid'] for t, m in markets.items()}
+        prices.update(self.get_prices([mp["ticker"] for mp in market_positions if mp["ticker"] not in prices]))
 
         # format the positions so that they hold the ticker, how much was paid per contract, and the current value of the position
         holdings = {
-            mp["ticker"]: {"posn": mp["position"], "price": int(mp['market_exposure'] / mp['position']), "value": requests.get(f'https://api.elections.kalshi.com/trade-api/v2/markets/{mp["ticker"]}').json()['market']['yes_bid']}
-            for mp in positions.json()['market_positions']
-            if mp["position"] != 0
+            mp["ticker"]: Holding(ticker=mp["ticker"], posn=mp["position"], price=int(mp['market_exposure'] / mp['position']), value=prices.get(mp["ticker"]))
+            for mp in market_positions
         }
-        return holdings
\ No newline at end of file
+        return holdings
+
+    def get_positions(self, markets=None):
+        return self.to_holdings(self.fetch_positions(), markets)
@@ -0,0 +1,178 @@
+import os
+import json
+import numpy as np
+
+# code for saving the training data as typed numpy columns instead of stringified dicts in a csv
+# a dataset is a directory that looks like this:
+#   <field>.npy   one flat column per field, holding every candlestick of every group back to back
+#   offsets.npy   where each group (e.g. the candlesticks of one market) starts and ends in the columns
+#   samples.npy   one (start, end, label) row per training sample; the sample is the candlesticks in [start, end)
+#                 and the label is the candlestick at index label (all indexes are into the flat columns)
+#   tickers.npy   (optional) the market ticker of each group, used by the backtest to put each market back together
+# everything is loaded with mmap_mode='r', so opening a dataset doesn't read (or parse) anything
+
+# the numeric fields that are kept from each candlestick, and how to get them out of the api's dict
+FIELDS = {
+    'yes_bid_open':  ('yes_bid', 'open'),
+    'yes_bid_high':  ('yes_bid', 'high'),
+    'yes_bid_low':   ('yes_bid', 'low'),
+    'yes_bid_close': ('yes_bid', 'close'),
+    'yes_ask_open':  ('yes_ask', 'open'),
+    'yes_ask_high':  ('yes_ask', 'high'),
+    'yes_ask_low':   ('yes_ask', 'low'),
+    'yes_ask_close': ('yes_ask', 'close'),
+    'volume':        ('volume',),
+    'open_interest': ('open_interest',),
+    'end_period_ts': ('end_period_ts',),
+}
+
+# timestamps don't fit in a float32 without losing minutes, so they get their own type
+DTYPES = {'end_period_ts': np.int64}
+
+
+def get_value(candlestick, path):
+    value = candlestick
+    for key in path:
+        value = value.get(key) if isinstance(value, dict) else None
+    # missing values are stored as 0, the same value used for padding
+    return 0 if value is None else value
+
+
+# turn a list of candlestick dicts into a dict of numpy columns
+def to_columns(candlesticks):
+    return {
+        field: np.array([get_value(c, path) for c in candlesticks], dtype=DTYPES.get(field, np.float32))
+        for field, path in FIELDS.items()
+    }
+
+
+# cut every group into fixed length windows without copying anything
+# lengths is the number of candlesticks in each group; a window covers `window` candlesticks, the next window starts
+# `stride` candlesticks later and the label is the candlestick `horizon` steps after the last one in the window
+# (all three have to be at least 1: a horizon of 0 would make the label the last candlestick of the input)
+# returns a (samples, 3) array of (start, end, label) indexes into the flat columns
+def window_samples(lengths, window=59, stride=59, horizon=1):
+    for name, value in (('window', window), ('stride', stride), ('horizon', horizon)):
+        if value < 1:
+            raise ValueError(f'{name} has to be at least 1, not {value}')
+    lengths = np.asarray(lengths, dtype=np.int64)
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+
+    # how many windows fit in each group (the label has to be inside the group too)
+    usable = lengths - window - horizon
+    counts = np.where(usable >= 0, usable // stride + 1, 0)
+
+    # for every window, which group it belongs to and which window of that group it is
+    group = np.repeat(np.arange(len(lengths)), counts)
+    first = np.cumsum(counts) - counts
+    k = np.arange(counts.sum()) - np.repeat(first, counts)
+
+    start = offsets[group] + k * stride
+    end = start + window
+    return np.stack([start, end, end - 1 + horizon], axis=1)
+
+
+# writes a dataset one group at a time, so only one group of candlestick dicts is ever in memory
+# each group is converted and appended to a raw file per field as it is added; close() turns them into the .npy columns
+#   writer = Writer(path)
+#   for ticker, candlesticks in ...:
+#       writer.add(candlesticks, ticker)
+#   writer.close(window_samples(writer.lengths))
+class Writer:
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.files = {field: open(self._raw(field), 'wb') for field in FIELDS}
+        self.lengths = []
+        self.tickers = []
+
+    def _raw(self, field):
+        return os.path.join(self.path, f'{field}.raw')
+
+    # ticker is the market ticker of the group (None if the dataset has no tickers)
+    def add(self, candlesticks, ticker=None):
+        for field, column in to_columns(candlesticks).items():
+            self.files[field].write(column.tobytes())
+        self.lengths.append(len(candlesticks))
+        self.tickers.append(ticker)
+
+    # samples is a list (or array) of (start, end, label) rows into the flat columns
+    def close(self, samples, chunk=1 << 20):
+        offsets = np.zeros(len(self.lengths) + 1, dtype=np.int64)
+        np.cumsum(self.lengths, out=offsets[1:])
+        total = int(offsets[-1])
+
+        for field, f in self.files.items():
+            f.close()
+            dtype = DTYPES.get(field, np.float32)
+            column = np.lib.format.open_memmap(os.path.join(self.path, f'{field}.npy'), mode='w+', dtype=dtype, shape=(total,))
+            if total:
+                raw = np.memmap(self._raw(field), dtype=dtype, mode='r', shape=(total,))
+                for i in range(0, total, chunk):
+                    column[i:i + chunk] = raw[i:i + chunk]
+                del raw
+            column.flush()
+            del column
+            os.remove(self._raw(field))
+
+        np.save(os.path.join(self.path, 'offsets.npy'), offsets)
+        np.save(os.path.join(self.path, 'samples.npy'), np.asarray(samples, dtype=np.int64).reshape(-1, 3))
+        if any(t is not None for t in self.tickers):
+            np.save(os.path.join(self.path, 'tickers.npy'), np.asarray(self.tickers, dtype=str))
+
+        with open(os.path.join(self.path, 'meta.json'), 'w') as f:
+            json.dump({'fields': list(FIELDS), 'groups': len(self.lengths), 'candlesticks': total}, f)
+
+    # give up on the dataset, removing the raw files
+    def abort(self):
+        for field, f in self.files.items():
+            f.close()
+            os.remove(self._raw(field))
+
+
+# groups is a list of candlestick lists, samples is a list (or array) of (start, end, label) rows into the flat columns
+# tickers is the market ticker of each group
+def write(path, groups, samples, tickers=None):
+    writer = Writer(path)
+    for i, group in enumerate(groups):
+        writer.add(group, None if tickers is None else tickers[i])
+    writer.close(samples)
+
+
+# memory-map a dataset written by write()
+def load(path):
+    with open(os.path.join(path, 'meta.json')) as f:
+        meta = json.load(f)
+
+    data = {field: np.load(os.path.join(path, f'{field}.npy'), mmap_mode='r') for field in meta['fields']}
+    data['offsets'] = np.load(os.path.join(path, 'offsets.npy'), mmap_mode='r')
+    data['samples'] = np.load(os.path.join(path, 'samples.npy'), mmap_mode='r')
+    if os.path.exists(os.path.join(path, 'tickers.npy')):
+        data['tickers'] = np.load(os.path.join(path, 'tickers.npy'))
+    return data
+
+
+# convert an old data.csv/labels.csv pair into the columnar format
+# each sample becomes its own group with its label appended to the end
+def convert_csv(data_csv, labels_csv, path):
+    import ast
+    import pandas as pd
+
+    data_df = pd.read_csv(data_csv)
+    label_df = pd.read_csv(labels_csv)
+
+    groups = []
+    samples = []
+    start = 0
+    for s, l in zip(data_df['dict'], label_df['dict']):
+        group = ast.literal_eval(s) + [ast.literal_eval(l)]
+        groups.append(group)
+        samples.append((start, start + len(group) - 1, start + len(group) - 1))
+        start += len(group)
+
+    write(path, groups, samples)
+
+
+if __name__ == '__main__':
+    convert_csv('../large_files/data.csv', '../large_files/labels.csv', '../large_files/dataset')
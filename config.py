@@ -0,0 +1,31 @@
+import os
+from dotenv import load_dotenv
+
+# settings shared by every module, read from the environment (or a .env file)
+load_dotenv()
+
+# the api every module talks to; point KALSHI_BASE_URL at mock_server.py to test without touching production
+BASE_URL = os.getenv("KALSHI_BASE_URL", "https://api.elections.kalshi.com").rstrip("/")
+API_URL = BASE_URL + "/trade-api/v2"
+
+# the model the decider trades with
+MODEL_PATH = os.getenv("KALSHI_MODEL_PATH", "../large_files/model.pth")
+
+# the series the bot trades and downloads training data for (comma separated); their events are found by
+# universe.py, so there is no list of dated event tickers to keep up to date
+SERIES = [s.strip() for s in os.getenv("KALSHI_SERIES", "KXHIGHCHI,KXHIGHDEN,KXHIGHNY,KXHIGHLAX,KXHIGHAUS,KXHIGHPHIL").split(",") if s.strip()]
+# how many seconds the list of open events is reused before it is fetched again
+UNIVERSE_TTL = int(os.getenv("KALSHI_UNIVERSE_TTL", "600"))
+
+# limits on the whole portfolio, checked before any buy is placed (0 means no limit)
+# the most that can be tied up in positions and open buys, in cents, and the most markets that can be held at once
+MAX_EXPOSURE = int(os.getenv("KALSHI_MAX_EXPOSURE", "0"))
+MAX_POSITIONS = int(os.getenv("KALSHI_MAX_POSITIONS", "0"))
+
+# where the decider writes its metrics after every cycle (.prom for Prometheus text, anything else for json), and the
+# port to serve them on for Prometheus to scrape (see metrics.py); neither is done if they aren't set
+METRICS_PATH = os.getenv("KALSHI_METRICS_PATH")
+METRICS_PORT = int(os.getenv("KALSHI_METRICS_PORT", "0")) or None
+
+# if set, every decider cycle is run under cProfile and the stats are collected in this file
+PROFILE_PATH = os.getenv("KALSHI_PROFILE")
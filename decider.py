@@ -1,232 +1,178 @@
-import requests
-import json
 import time
-from nn import KalshiCNN
-import ast
-import torch 
+import asyncio
+import argparse
+from concurrent.futures import ThreadPoolExecutor
 from client import Client
-import copy
-import math
-
-url = "https://api.elections.kalshi.com/trade-api/v2/events"
-# the days for which you would like to trade
-weather = ['KXHIGHCHI-25MAY28', 'KXHIGHDEN-25MAY28', 'KXHIGHNY-25MAY28', 'KXHIGHLAX-25MAY28', 'KXHIGHLAX-25MAY28', 'KXHIGHAUS-25MAY28', 'KXHIGHPHIL-25MAY28']
-
-# this, with the next for loop, will get the markets for the events you want to trade
-# definitionally, the markets are the yes/no bets for the event (e.g., an event is the weather in Chicago on May 28, 2025 and 
-# a particular market is 'will the high temperature be between 60 and 61 degrees?')
-events = []
-
-for event_ticker in weather:
-    final_url = url + f'/{event_ticker}?with_nested_markets=true'
-
-    headers = {"accept": "application/json"}
-
-    response = requests.get(final_url, headers=headers)
-
-    events.append(json.loads(response.text))
-
-# get the candlesticks (essentially volatility data) for the markets you want to trade
-def get_candlesticks(events):
-    candlesticks = {}
-    for event in events:
-        for market in event['event']['markets']:
-            # if there is no volume, the market is stagnant and shouldn't be traded
-            if market['volume'] == 0:
-                continue
-
-            # markets have their own tickers, distinct from the event ticker
-            ticker = market['ticker']
-
-            # this should be almost disregarded and is only necessary for the api call
-            # however, the series ticker is a broader category of the event ticker
-            # e.g., a series ticker might denote all weather events for Chicago, whereas an event
-            # ticker is only one day
-            series_ticker = event['event']['series_ticker']
-
-            url = f'https://api.elections.kalshi.com/trade-api/v2/series/{series_ticker}/markets/{ticker}/candlesticks'
-
-            # get the candlestick data for the previous 4 hours
-            start_ts = int(time.time()) - (14400 * 2)
-            end_ts = int(time.time())
-            
-            # get data every 1 minute
-            period_interval = 1
-
-            url = url + f'?start_ts={start_ts}&end_ts={end_ts}&period_interval={period_interval}'
-
-            headers = {"accept": "application/json"}
-            response = requests.get(url, headers=headers)
-
+from orders import OrderManager, RiskView
+import fetcher
+import config
+from snapshot import take_snapshot
+from universe import MarketUniverse
+from candle_buffer import CandleBuffers
+import metrics
+import strategy
+
+# the live trading bot; run it with python decider.py (or python kalshi.py trade)
+# importing this module doesn't touch the api or the model: everything is set up by Decider(), and the model (which
+# needs torch, a couple of seconds to import on its own) is loaded in the background while the decider waits for its
+# first cycle, so the bot is ready to go well within a second of starting (bench_decider.py measures it)
+
+# how often the bot trades (the cycles start on these boundaries, e.g. at the top of every minute)
+CYCLE_SECONDS = 60
+# the longest each part of a cycle is allowed to take before it is given up on
+SNAPSHOT_TIMEOUT = 20
+POSITIONS_TIMEOUT = 10
+ORDER_TIMEOUT = 10
+# the timeout of each market data request; a market whose data doesn't arrive in time is skipped for this cycle
+REQUEST_TIMEOUT = 5
+
+
+# load the model, and the feature spec its inputs are built with (see features.py)
+def _load_model(path):
+    from inference import load
+    return load(path)
+
+
+# run a blocking function in a thread, giving up on it after timeout seconds
+# (the thread itself can't be killed, but the cycle stops waiting for it)
+async def bounded(limit, func, *args, **kwargs):
+    return await asyncio.wait_for(asyncio.to_thread(func, *args, **kwargs), limit)
+
+
+class Decider:
+    # model_path is the model to trade with (config.MODEL_PATH by default), series the series to trade (config.SERIES)
+    # can_buy is a testing switch to control whether or not the bot can buy
+    def __init__(self, model_path=None, series=None, can_buy=True):
+        self.can_buy = can_buy
+
+        # the model loads in the background; run() waits for it before the first cycle
+        self.loader = ThreadPoolExecutor(1)
+        self.model = self.loader.submit(_load_model, model_path or config.MODEL_PATH)
+
+        # the pooled session used for every market data request (see snapshot.py)
+        self.session = fetcher.make_session(pool_size=20)
+
+        # the events to trade: every open event of the series in config.SERIES, found again every config.UNIVERSE_TTL
+        # seconds (so the bot moves on to the next day's markets by itself; see universe.py)
+        # definitionally, the markets are the yes/no bets for the event (e.g., an event is the weather in Chicago on May
+        # 28, 2025 and a particular market is 'will the high temperature be between 60 and 61 degrees?')
+        self.universe = MarketUniverse(self.session, series)
+
+        # the last 59 candlesticks of every market; each cycle only fetches the minutes since the last one (see candle_buffer.py)
+        self.buffers = CandleBuffers(size=59)
+
+        # initialize the client (used for api calls)
+        self.client = Client()
+
+        # every order the bot places goes through here, so it knows which orders are still waiting (see orders.py)
+        self.orders = OrderManager(self.client)
+
+    # the model and its feature spec, once they have loaded
+    def wait_for_model(self, timeout=None):
+        return self.model.result(timeout)
+
+    # place every order of a cycle in one concurrent batch, so a slow order for one market never holds up the others
+    async def place_orders(self, placing):
+        if not placing:
+            return []
+        try:
+            results = await bounded(ORDER_TIMEOUT, self.orders.place_many, placing)
+        except asyncio.TimeoutError:
+            print(f'{len(placing)} orders timed out')
+            return []
+        # print the result of every api call
+        for (key, action, _, _), (status, text) in zip(placing, results):
+            print(f'{key} {"bought" if action == "buy" else "sold"}, status: {status if status is not None else text}')
+        return results
+
+    async def run_cycle(self):
+        # the market data, the positions and the state of the open orders don't depend on each other, so they are
+        # fetched at the same time (the open orders with one poll of /portfolio/orders)
+        events = await bounded(SNAPSHOT_TIMEOUT, self.universe.events)
+        snapshot_task = asyncio.create_task(bounded(SNAPSHOT_TIMEOUT, take_snapshot, self.session, events,
+                                                    timeout=REQUEST_TIMEOUT, buffers=self.buffers))
+        positions_task = asyncio.create_task(bounded(POSITIONS_TIMEOUT, self.client.fetch_positions))
+        orders_task = asyncio.create_task(bounded(POSITIONS_TIMEOUT, self.orders.reconcile))
+
+        try:
+            snapshot, stats = await snapshot_task
+            print(f'snapshot: {stats}')
+            # the positions are valued with the snapshot's market records, so only positions outside it need another call
+            holdings = await bounded(POSITIONS_TIMEOUT, self.client.to_holdings, await positions_task, snapshot.markets)
+            try:
+                await orders_task
+            except Exception as e:
+                # the open orders are still known from when they were placed, they just might have filled since
+                print(f'order reconcile failed: {e}')
+        finally:
+            # if any of them failed, the others are given up on too (and their errors aren't left unretrieved)
+            for task in (snapshot_task, positions_task, orders_task):
+                task.cancel()
+            await asyncio.gather(snapshot_task, positions_task, orders_task, return_exceptions=True)
+
+        # one forward pass for every market, used for both buying and selling (the trading rules live in strategy.py)
+        model, spec = self.wait_for_model()
+        predictions = strategy.predict_all(model, spec, snapshot.candlesticks)
+
+        # buying and selling both act on the same fresh snapshot
+        buys = strategy.buy_decisions(snapshot, holdings, predictions, self.orders) if self.can_buy else []
+        # buys that would take the portfolio past its limits are dropped
+        buys = RiskView(holdings, self.orders.open_orders(), config.MAX_EXPOSURE, config.MAX_POSITIONS).filter_buys(buys)
+        sells = strategy.sell_decisions(holdings, snapshot, predictions, self.orders)
+
+        placing = [(key, 'buy', yes_ask, 1) for key, yes_ask in buys]
+        placing += [(key, 'sell', yes_offer, count) for key, yes_offer, count in sells]
+        await self.place_orders(placing)
+
+    async def run(self):
+        # the bot can't trade without its model, so a model that doesn't load stops it here instead of failing every cycle
+        try:
+            await asyncio.wrap_future(self.model)
+        except Exception as e:
+            raise SystemExit(f'could not load the model: {e}')
+
+        if config.METRICS_PORT:
+            metrics.serve(config.METRICS_PORT)
+        while True:
+            # wait for the start of the next cycle, so the cycles don't drift with api latency
+            await asyncio.sleep(CYCLE_SECONDS - time.time() % CYCLE_SECONDS)
+            print(f'orders: {self.orders.summary()}')
+
+            # a cycle is cancelled if it runs into the next one
             try:
-                # only trade on the last hour of data (i.e., the last 59 candlesticks)
-                candlesticks[ticker] = response.json()['candlesticks'][-59:] if len(response.json()['candlesticks']) > 59 else response.json()['candlesticks']
-            except:
-                pass
-
-    return candlesticks
-
-# parse the candlestick data into a list of floats
-def parse_dict(s):
-    out = []
-    for d in s:
-        out.extend([d['yes_bid']['open'], d['volume']])
-    return out
-
-# load the model
-inference_model = torch.load("../large_files/model.pth")
-inference_model.eval()
-
-# initialize the client (used for api calls)
-client = Client()
-
-# make the input for the model the proper shape
-def get_item(dicts):
-    if len(dicts) == 0:
-        return None 
-    numeric = parse_dict(dicts)
-    pad_needed = (59 * 2 - len(numeric))
-    numeric.extend([0.0]*pad_needed)
-    x = torch.tensor(numeric, dtype=torch.float32).view(1, 2, 59)
-
-    return x
-
-# a couple of safeguards to avoid buying in dangerous edge cases
-def verify_buyability(ticker):
-    url_orderbook = f'https://api.elections.kalshi.com/trade-api/v2/markets/{ticker}/orderbook'
-    url_market = f'https://api.elections.kalshi.com/trade-api/v2/markets/{ticker}'
-    headers = {"accept": "application/json"}
-
-    # get the orderbook data (data regarding the demand for a bid)
-    response_orderbook = requests.get(url_orderbook, headers=headers)
-    orderbook = response_orderbook.json()
-
-    # get the market data (data regarding the last price (sell offer))
-    response_market = requests.get(url_market, headers=headers)
-    market = response_market.json()
-    yes_ask = market['market']['last_price']
-
-    # get the last actual bid
-    yes_offer = orderbook['orderbook']['yes']
-
-    # if there are no offers, don't buy because it may be 
-    # impossible to sell later on
-    # for example, if the bot wants to buy a 1 cent conract, predicting it will go up 2 cents,
-    # it will never be able to sell, leading to a loss
-    if yes_offer == [] or yes_offer == None:
-        return False, None
-    
-    # if the last ask is less than the last bid + 2 cents, buy
-    if yes_ask < yes_offer[-1][0] + 2:
-        return True, yes_ask
-    else:
-        return False, None
-    
-# a couple of safeguards to sell when a position is suffering
-def verify_sellability(ticker, original_price):
-    url_orderbook = f'https://api.elections.kalshi.com/trade-api/v2/markets/{ticker}/orderbook'
-    headers = {"accept": "application/json"}
-
-    # get the orderbook data (data regarding the demand for a bid)
-    response_orderbook = requests.get(url_orderbook, headers=headers)
-    orderbook = response_orderbook.json()
-    
-    # get the last actual bid
-    yes_offer = orderbook['orderbook']['yes']
-
-    if yes_offer == [] or yes_offer == None:
-        return False, None
-
-    # if the price at the time you purchased the position is less than the last bid, sell
-    if original_price < yes_offer[-1][0]:
-        return True, yes_offer[-1][0]
-    else:
-        return False, None
-
-def buy_holdings(candlesticks, holdings):
-    for key, value in candlesticks.items():
-        # get the properly formmated input for the model
-        data = get_item(value)
-        if data is not None:
-            with torch.no_grad():
-                # have the model evaluate the input
-                model_output = inference_model(data)
-            
-            # if the last bid is less than the model's prediction, buy
-            if value[-1]['yes_bid']['open'] < model_output.item():
-                # verify buyability first, using logic from verify_buyability
-                buyable, yes_ask = verify_buyability(key)
-                if buyable:
-                    # make the api call to buy
-                    result = client.make_request(key, 'buy', yes_ask, count=1)
-                    # print the result of the api call
-                    print(f'{key} bought, status: {result[0]}')
-
-def sell_holdings(holdings, candlesticks, currently_selling):
-    keys_to_delete = []
-    for key, value in currently_selling.items():
-        if time.time() - value > 180:
-            keys_to_delete.append(key)
-    
-    for key in keys_to_delete:
-        del(currently_selling[key])
-
-    for key, value in candlesticks.items():
-        data = get_item(value)
-        if data is not None:
-            with torch.no_grad():
-                # have the model evaluate the input, to get a prediction for whether or not the price will go down
-                model_output = inference_model(data)
-            # if you currently own the position and its last bid is greater than the model's prediction, sell
-            if key in holdings and value[-1]['yes_bid']['open'] > model_output.item():
-
-                # verify sellability first, using logic from verify_sellability
-                sellable, yes_offer = verify_sellability(key, holdings[key]['price'])
-
-                # if the position is not already being sold and the position is sellable, sell
-                # there is a 3 minute cooldown between limit order sells
-                already_selling = True if key in currently_selling and time.time() - currently_selling[key] < 180 else False
-
-                # if the position is sellable and not already being sold, sell  
-                if sellable and not already_selling:
-                    # make the api call to sell
-                    result = client.make_request(key, 'sell', yes_offer, count=holdings[key]['posn']) 
-                    # print the result of the api call
-                    print(f'{key} sold, status: {result[0]}')
-                    # delete the position from the holdings
-                    del(holdings[key])
-                    # add the position to the list of positions being sold
-                    currently_selling[key] = time.time()
-    
-    return currently_selling
-
-    # if the position has lost more than 5 cents, sell
-    holdings_copy = copy.deepcopy(holdings)
-    for key, value in holdings.items():
-        # if the position has lost more than 5 cents, sell
-        if value['price'] - value['value'] > 5:
-            # make the api call to sell
-            result = client.make_request(key, 'sell', math.floor(value['price']), count=holdings[key]['posn']) 
-            # print the result of the api call
-            print(f'{key} sold, status: {result[0]}')
-            # delete the position from the holdings
-            del(holdings_copy[key])
-            # add the position to the list of positions being sold
-            currently_selling.append({key: time.time()})
-
-    holdings = holdings_copy
-    return currently_selling
-
-# testing variable to control whether or not the bot can buy
-can_buy = True
-
-currently_selling = {}
-while True:
-    print(currently_selling)
-    holdings = client.get_positions()
-    candlesticks = get_candlesticks(events)
-    if can_buy:
-        buy_holdings(candlesticks, holdings)
-        holdings = client.get_positions()
-    time.sleep(60)
-    currently_selling = sell_holdings(holdings, candlesticks, currently_selling)
\ No newline at end of file
+                with metrics.span('cycle'), metrics.profile(config.PROFILE_PATH):
+                    await asyncio.wait_for(self.run_cycle(), CYCLE_SECONDS - 1)
+            except asyncio.TimeoutError:
+                metrics.inc('cycle_timeouts_total')
+                print('cycle timed out')
+            except Exception as e:
+                print(f'cycle failed: {e}')
+            if config.METRICS_PATH:
+                metrics.write(config.METRICS_PATH)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='trade with the model')
+    parser.add_argument('--model', default=None, help='the model to trade with (config.MODEL_PATH by default)')
+    parser.add_argument('--series', nargs='*', default=None, help='the series to trade (config.SERIES by default)')
+    parser.add_argument('--no-buy', action='store_true', help='only sell what is already held')
+    parser.add_argument('--shards', type=int, default=0, help='run the decider across this many processes (see sharded.py)')
+    args = parser.parse_args(argv)
+
+    if args.shards:
+        import sharded
+        coordinator = sharded.Coordinator(args.shards, args.series, args.model)
+        try:
+            coordinator.run(can_buy=not args.no_buy)
+        finally:
+            coordinator.stop()
+        return
+
+    started = time.perf_counter()
+    decider = Decider(args.model, args.series, can_buy=not args.no_buy)
+    print(f'decider ready in {time.perf_counter() - started:.2f}s')
+    asyncio.run(decider.run())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,212 @@
+import os
+import json
+import numpy as np
+import columnar
+from columnar import FIELDS
+
+# the model inputs, built the same way for training (process_data.py), live trading (decider.py) and the backtest
+# an input is a (channels, window) float32 array: one row per channel, holding the last `window` candlesticks of a
+# market oldest first, padded at the end with zeros when there are fewer candlesticks than that
+#
+# a channel is any field in columnar.FIELDS (except end_period_ts) or one of the derived channels below
+# each channel can be normalized with the mean and std of its series (e.g. KXHIGHNY); the stats are fitted once on a
+# dataset, cached next to it and saved in the model artifact, so the decider normalizes with exactly the same numbers
+# (markets only live for a day, so the stats are kept per series rather than per market ticker; series that weren't in
+# the training data use the stats of the whole dataset, kept under '*')
+
+DERIVED = {
+    'spread': lambda c: c['yes_ask_close'] - c['yes_bid_close'],
+    'mid': lambda c: (c['yes_ask_close'] + c['yes_bid_close']) / 2,
+}
+CHANNELS = [f for f in FIELDS if f != 'end_period_ts'] + list(DERIVED)
+
+DEFAULT_CHANNELS = ['yes_bid_close', 'yes_ask_close', 'spread', 'volume', 'open_interest']
+GLOBAL = '*'
+STATS_FILE = 'feature_stats.json'
+
+
+# split the samples of a dataset by time: the samples whose labels are the newest val_fraction of the data are the
+# validation set; returns (train indexes, validation indexes, the label time the validation set starts at)
+# (a random split would leak the future into training, since neighbouring windows overlap in time)
+def time_split(data, val_fraction=0.1):
+    samples = np.asarray(data['samples'])
+    label_ts = np.asarray(data['end_period_ts'])[samples[:, 2]]
+    order = np.argsort(label_ts, kind='stable')
+    n_val = int(len(order) * val_fraction)
+    cutoff = label_ts[order[len(order) - n_val]] if n_val else np.inf
+    return np.sort(order[:len(order) - n_val]), np.sort(order[len(order) - n_val:]), cutoff
+
+
+# the series of a market ticker ('KXHIGHNY-25MAY28-T60' -> 'KXHIGHNY')
+def series_of(ticker):
+    return str(ticker).split('-')[0]
+
+
+# one channel as a flat float32 array, from a dict of columns (see columnar.to_columns / columnar.load)
+def channel(columns, name):
+    if name in DERIVED:
+        return np.asarray(DERIVED[name](columns), dtype=np.float32)
+    return np.asarray(columns[name], dtype=np.float32)
+
+
+# the fields of columns at idx (any shape of index array), gathered the first time each one is asked for
+# build() works out every channel from these, so a derived channel only ever sees the candlesticks it needs instead of
+# the whole column
+class _Gathered(dict):
+    def __init__(self, columns, idx):
+        super().__init__()
+        self.columns = columns
+        self.idx = idx
+
+    def __missing__(self, field):
+        self[field] = np.asarray(self.columns[field])[self.idx]
+        return self[field]
+
+
+class FeatureSpec:
+    # channels is a list of channel names, window the number of candlesticks in an input
+    # stats is series -> {'mean': [...], 'std': [...]} (one value per channel), or None to feed the raw values
+    # interleaved=True is the layout the first model was trained on (pairs of values viewed as (channels, window)),
+    # only kept so old model files still get the inputs they expect
+    def __init__(self, channels=None, window=59, stats=None, interleaved=False):
+        self.channels = list(channels or DEFAULT_CHANNELS)
+        unknown = [c for c in self.channels if c not in CHANNELS]
+        if unknown:
+            raise ValueError(f'unknown channels {unknown}, pick from {CHANNELS}')
+        self.window = window
+        self.stats = stats
+        self.interleaved = interleaved
+        self._arrays = None
+
+    def __len__(self):
+        return len(self.channels)
+
+    def __eq__(self, other):
+        return isinstance(other, FeatureSpec) and self.to_config() == other.to_config()
+
+    def to_config(self):
+        return {'channels': self.channels, 'window': self.window, 'stats': self.stats, 'interleaved': self.interleaved}
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(config['channels'], config['window'], config.get('stats'), config.get('interleaved', False))
+
+    # the same spec with its stats fitted on the given columns (keys is the series of every candlestick, or None)
+    def fit(self, columns, keys=None):
+        values = np.stack([channel(columns, name) for name in self.channels], axis=1).astype(np.float64)
+        stats = {GLOBAL: _moments(values)}
+        if keys is not None:
+            names, inverse = np.unique(np.asarray(keys), return_inverse=True)
+            counts = np.bincount(inverse, minlength=len(names))[:, None]
+            sums = np.stack([np.bincount(inverse, values[:, c], len(names)) for c in range(len(self))], axis=1)
+            squares = np.stack([np.bincount(inverse, values[:, c] ** 2, len(names)) for c in range(len(self))], axis=1)
+            mean = sums / counts
+            std = np.sqrt(np.maximum(squares / counts - mean ** 2, 0))
+            for i, name in enumerate(names):
+                stats[str(name)] = {'mean': mean[i].tolist(), 'std': np.where(std[i] > 1e-6, std[i], 1.0).tolist()}
+        return FeatureSpec(self.channels, self.window, stats, self.interleaved)
+
+    # (mean, std) arrays of shape (len(keys), channels), falling back to the global stats for unknown series
+    def _moments_of(self, keys):
+        if self._arrays is None:
+            names = list(self.stats)
+            self._arrays = (names, np.array([self.stats[n]['mean'] for n in names], dtype=np.float32),
+                            np.array([self.stats[n]['std'] for n in names], dtype=np.float32))
+        names, mean, std = self._arrays
+        lookup = {n: i for i, n in enumerate(names)}
+        if keys is None:
+            row = np.zeros(1, dtype=np.int64) + lookup[GLOBAL]
+            return mean[row], std[row]
+        unique, inverse = np.unique(np.asarray(keys), return_inverse=True)
+        rows = np.array([lookup.get(str(k), lookup[GLOBAL]) for k in unique], dtype=np.int64)[inverse]
+        return mean[rows], std[rows]
+
+    # the inputs for a batch of samples, all at once
+    # columns is a dict of flat columns, each sample is the candlesticks in [starts[i], ends[i]) (only the last `window`
+    # of them are used) and keys is the series of each sample (only needed if the spec has stats)
+    # returns a (samples, channels, window) float32 array
+    def build(self, columns, starts, ends, keys=None):
+        starts = np.asarray(starts, dtype=np.int64)
+        ends = np.asarray(ends, dtype=np.int64)
+        lengths = np.clip(ends - starts, 0, self.window)
+        positions = np.arange(self.window)
+        valid = positions < lengths[:, None]
+        idx = np.where(valid, (ends - lengths)[:, None] + positions, 0)
+
+        if self.stats:
+            mean, std = self._moments_of(keys)
+        # every field is gathered at idx once, and shared by the channels that need it
+        gathered = _Gathered(columns, idx)
+        out = np.empty((len(starts), len(self), self.window), dtype=np.float32)
+        for c, name in enumerate(self.channels):
+            values = channel(gathered, name) if idx.size else np.zeros(idx.shape, np.float32)
+            if self.stats:
+                values = (values - mean[:, c, None]) / std[:, c, None]
+            out[:, c] = np.where(valid, values, 0)
+
+        if self.interleaved:
+            out = np.ascontiguousarray(out.transpose(0, 2, 1)).reshape(len(starts), len(self), self.window)
+        return out
+
+    # the inputs of many live markets at once
+    # candles maps ticker -> a (candlesticks, fields) array, oldest first, with one column per field of columnar.FIELDS
+    # (what candle_buffer.CandleBuffer.array() holds); returns (tickers, (markets, channels, window) array)
+    def build_markets(self, candles):
+        tickers = [t for t, c in candles.items() if len(c)]
+        if not tickers:
+            return tickers, np.zeros((0, len(self), self.window), dtype=np.float32)
+        rows = np.concatenate([candles[t][-self.window:] for t in tickers])
+        columns = {field: rows[:, i] for i, field in enumerate(FIELDS)}
+        ends = np.cumsum([min(len(candles[t]), self.window) for t in tickers], dtype=np.int64)
+        starts = ends - np.minimum([len(candles[t]) for t in tickers], self.window)
+        return tickers, self.build(columns, starts, ends, [series_of(t) for t in tickers])
+
+    # a mask of the same shape as the inputs, True wherever a value is real rather than padding
+    def mask(self, lengths):
+        lengths = np.minimum(np.asarray(lengths), self.window)
+        mask = np.broadcast_to(np.arange(self.window) < lengths[:, None, None], (len(lengths), len(self), self.window))
+        if self.interleaved:
+            mask = np.arange(len(self) * self.window).reshape(1, len(self), self.window) < len(self) * lengths[:, None, None]
+        return mask
+
+
+def _moments(values):
+    std = values.std(axis=0)
+    return {'mean': values.mean(axis=0).tolist(), 'std': np.where(std > 1e-6, std, 1.0).tolist()}
+
+
+# the spec the decider used before there was a feature spec: (yes_bid open, volume) pairs, not normalized
+def legacy_spec(window=59):
+    return FeatureSpec(['yes_bid_open', 'volume'], window, interleaved=True)
+
+
+# the series of every candlestick of a dataset loaded with columnar.load (None if it has no tickers.npy)
+def dataset_keys(data):
+    if 'tickers' not in data:
+        return None
+    series = np.array([series_of(t) for t in data['tickers']])
+    return np.repeat(series, np.diff(np.asarray(data['offsets'])))
+
+
+# fit a spec on a dataset directory, reusing the stats cached next to it if the dataset hasn't changed since
+# the stats only see the candlesticks from before the validation set starts (see time_split), so the validation inputs
+# are normalized without knowing anything about the validation period
+def fit_dataset(path, channels=None, window=59, data=None, val_fraction=0.1):
+    spec = FeatureSpec(channels, window)
+    cache = os.path.join(path, STATS_FILE)
+    if os.path.exists(cache) and os.path.getmtime(cache) >= os.path.getmtime(os.path.join(path, 'samples.npy')):
+        with open(cache) as f:
+            cached = json.load(f)
+        if cached['channels'] == spec.channels and cached.get('val_fraction') == val_fraction:
+            return FeatureSpec(spec.channels, window, cached['stats'])
+
+    if data is None:
+        data = columnar.load(path)
+    _, _, cutoff = time_split(data, val_fraction)
+    train = np.asarray(data['end_period_ts']) < cutoff
+    keys = dataset_keys(data)
+    spec = spec.fit({field: np.asarray(data[field])[train] for field in FIELDS}, None if keys is None else keys[train])
+    with open(cache + '.tmp', 'w') as f:
+        json.dump({'channels': spec.channels, 'stats': spec.stats, 'val_fraction': val_fraction}, f)
+    os.replace(cache + '.tmp', cache)
+    return spec
@@ -0,0 +1,167 @@
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import parsedate_to_datetime
+import metrics
+
+# code for fanning out many GET requests at once over a shared requests session
+# the session's HTTPAdapter already keeps a pool of connections, this just keeps the pool busy
+
+# a simple token bucket shared by every worker thread
+# rate is the number of requests per second allowed (None means no limit)
+class RateLimiter:
+    def __init__(self, rate=None, burst=None):
+        self.rate = rate
+        self.capacity = burst if burst is not None else (rate or 1)
+        self.tokens = self.capacity
+        self.last = time.monotonic()
+        # when the api returns a 429, every thread waits until this time
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                wait = self.paused_until - now
+                if wait <= 0:
+                    if self.rate is None:
+                        return
+                    # refill the bucket based on how much time has passed
+                    self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+                    self.last = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    # stop all requests for the given number of seconds (used for Retry-After)
+    def pause(self, seconds):
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+
+# keeps track of how long each request took so the pool size can be tuned against the api limits
+class FetchStats:
+    def __init__(self):
+        self.latencies = []
+        self.errors = 0
+        self.throttled = 0
+        self.started = time.monotonic()
+        self.lock = threading.Lock()
+
+    def record(self, latency):
+        with self.lock:
+            self.latencies.append(latency)
+
+    def count(self, field):
+        with self.lock:
+            setattr(self, field, getattr(self, field) + 1)
+
+    def summary(self):
+        with self.lock:
+            latencies = sorted(self.latencies)
+        elapsed = time.monotonic() - self.started
+
+        def pct(p):
+            if not latencies:
+                return 0.0
+            return latencies[min(len(latencies) - 1, int(p / 100 * len(latencies)))]
+
+        return {
+            "requests": len(latencies),
+            "errors": self.errors,
+            "throttled": self.throttled,
+            "requests_per_sec": len(latencies) / elapsed if elapsed > 0 else 0.0,
+            "p50": pct(50),
+            "p95": pct(95),
+            "p99": pct(99),
+            "max": latencies[-1] if latencies else 0.0,
+        }
+
+    def __str__(self):
+        s = self.summary()
+        return (f"{s['requests']} requests, {s['errors']} errors, {s['throttled']} throttled, "
+                f"{s['requests_per_sec']:.1f} req/s, p50 {s['p50']*1000:.0f}ms, "
+                f"p95 {s['p95']*1000:.0f}ms, p99 {s['p99']*1000:.0f}ms")
+
+
+# the Retry-After header can either be a number of seconds or an http date
+def _retry_after(response, default=1.0):
+    value = response.headers.get("Retry-After")
+    if value is None:
+        return default
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return default
+
+
+def fetch_json(session, url, limiter, stats, max_attempts=5, timeout=10):
+    endpoint = metrics.endpoint(url)
+    for attempt in range(max_attempts):
+        limiter.acquire()
+        start = time.monotonic()
+        try:
+            response = session.get(url, timeout=timeout)
+        except Exception as e:
+            stats.count('errors')
+            metrics.inc('http_errors_total', endpoint=endpoint, method='GET')
+            print(f'{url} failed: {e}')
+            # no point waiting after the last attempt
+            if attempt < max_attempts - 1:
+                time.sleep(0.5 * 2 ** attempt)
+            continue
+        latency = time.monotonic() - start
+        stats.record(latency)
+        metrics.observe('http_request_seconds', latency, endpoint=endpoint, method='GET')
+        metrics.inc('http_responses_total', endpoint=endpoint, method='GET', status=response.status_code)
+
+        # if the api says to slow down, make every thread slow down (not just this one)
+        if response.status_code == 429:
+            stats.count('throttled')
+            limiter.pause(_retry_after(response, default=0.5 * 2 ** attempt))
+            continue
+
+        try:
+            return response.json()
+        except ValueError:
+            stats.count('errors')
+            print(response.text)
+            return None
+
+    stats.count('errors')
+    return None
+
+
+# fetch every url concurrently; the results come back in the same order as the urls
+# failed requests come back as None
+def fetch_all(session, urls, max_workers=20, limiter=None, stats=None, timeout=10, max_attempts=5):
+    limiter = limiter if limiter is not None else RateLimiter()
+    stats = stats if stats is not None else FetchStats()
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        results = list(pool.map(lambda url: fetch_json(session, url, limiter, stats, max_attempts=max_attempts, timeout=timeout), urls))
+
+    return results, stats
+
+
+# a requests session with a connection pool big enough for max_workers threads and retries on server errors
+# 429s are left to fetch_json so that every thread backs off together
+def make_session(pool_size=20):
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+
+    retry = Retry(total=3, backoff_factor=0.5, status_forcelist=[500, 502, 503, 504], respect_retry_after_header=False)
+    adapter = HTTPAdapter(max_retries=retry, pool_connections=pool_size, pool_maxsize=pool_size)
+
+    session = requests.Session()
+    session.headers.update({"accept": "application/json"})
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
@@ -1,112 +1,169 @@
-import requests
-import json
-from requests.adapters import HTTPAdapter
-from datetime import datetime, timezone
-import pandas as pd
-from urllib3.util.retry import Retry
-
-# this code is not critical to understand; it just increases API call reliability and efficiency
-retry = Retry(total=3, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504])
-adapter = HTTPAdapter(max_retries=retry, pool_connections=20, pool_maxsize=20)
-
-# instantiate the requests session
-session = requests.Session()
-session.headers.update({"accept": "application/json"})
-session.mount("https://", adapter)
+import time
+import argparse
+import fetcher
+import config
+import candle_store
+import universe
+import columnar
+
+# how many candlestick requests can be in flight at once (should match the size of the connection pool)
+MAX_WORKERS = 20
+# the maximum number of requests per second (None means no limit, 429s from the api will still slow things down)
+RATE_LIMIT = None
+
+# where the downloaded events and candlesticks are kept between runs
+STORE_PATH = 'candles.db'
+# how many windows are fetched before they are saved to the store
+STORE_CHUNK = 2000
+# where the training data is written (see columnar.py for the format)
+DATASET_PATH = 'dataset'
+# the default size of each training sample, how far apart samples start, and how far ahead the label is (see --window,
+# --stride and --horizon)
+WINDOW = 59
+STRIDE = 59
+HORIZON = 1
+# the maximum number of 100 minute windows to download
+# this is arbitrary; if you want more data, increase the number (and vice versa)
+MAX_WINDOWS = 1000000
+
+# the pooled session every request goes over (retries server errors; 429s are left to the fetcher so that every thread
+# backs off together)
+session = fetcher.make_session(pool_size=MAX_WORKERS)
 
 # get the data for training the model
-def get_events():
-    url = "https://api.elections.kalshi.com/trade-api/v2/events"
-
-    # these are the events that will be used to train the model
-    # dates formatted like yyMONTHdd
-    weather = ['KXHIGHCHI-', 'KXHIGHDEN-', 'KXHIGHNY-', 'KXHIGHLAX-', 'KXHIGHAUS-', 'KXHIGHPHIL-']
-
-    # these dates combined with the values in the previous list give the names of markets that can be traded
-    march_dates = [f'25MAR{str(day).zfill(2)}' for day in range(1, 32)]
-    april_dates = [f'25APR{str(day).zfill(2)}' for day in range(1, 30)]
-    may_dates = [f'25MAY{str(day).zfill(2)}' for day in range(1, 23)]
-    all_dates = march_dates + april_dates + may_dates
-    
-    # create all combinations of weather stations and dates
-    weather_with_date = [w + date for w in weather for date in all_dates]
-
+# every event of every series in config.SERIES is listed with a few paged calls (see universe.py), instead of trying
+# every city and date one request at a time
+def get_events(series=None):
     events = []
-
-    # this just gets the events for the markets that can be traded
-    for event_ticker in weather_with_date:
-        final_url = url + f'/{event_ticker}?with_nested_markets=true'
-
-        headers = {"accept": "application/json"}
-
-        response = session.get(final_url, headers=headers)
-
-        events.append(json.loads(response.text))
-
+    for series_ticker, found in universe.discover(session, series or config.SERIES).items():
+        print(f'{series_ticker}: {len(found)} events')
+        events.extend(found)
     return events
 
-def get_candlesticks(events):
+def get_candlesticks(events, store, max_workers=MAX_WORKERS, rate_limit=RATE_LIMIT):
     # series > event > market: each event has multiple markets; each event lasts a day but is contained within a series (more info in the decider.py file)
 
-    # candlesticks contain historial pricing data for each market
-    candlesticks = []
+    # first, work out every 100 minute window for every market
+    # windows = every window that makes up the data, missing = the windows that aren't in the store yet
+    # markets = (series_ticker, ticker) -> the start_ts of each of its windows
+    windows = []
+    missing = []
+    markets = {}
 
     for event in events:
         for market in event['event']['markets']:
             ticker = market['ticker']
             series_ticker = event['event']['series_ticker']
 
-            url = f'https://api.elections.kalshi.com/trade-api/v2/series/{series_ticker}/markets/{ticker}/candlesticks'
-
-            start_ts = market['open_time']
-            end_ts = market['close_time']
+            url = f'{config.API_URL}/series/{series_ticker}/markets/{ticker}/candlesticks'
 
-            # some times have microseconds; get rid of the microseconds
-            if '.' in start_ts:
-                start_ts = start_ts.split('.')[0] + 'Z'
-            if '.' in end_ts:
-                end_ts = end_ts.split('.')[0] + 'Z'
+            start_ts = universe.to_timestamp(market['open_time'])
+            end_ts = universe.to_timestamp(market['close_time'])
 
-            # convert the start and end times to timestamps (the format given by the api is not appropriate for api calls - yes, this is odd)
-            start_ts = int(datetime.strptime(start_ts, "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=timezone.utc).timestamp())
-            end_ts = int(datetime.strptime(end_ts, "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=timezone.utc).timestamp())
+            # markets that are still open only have data up until now
+            end_ts = min(end_ts, int(time.time()))
+            complete = store.complete_windows(series_ticker, ticker)
             
             # get data every 1 minute
             period_interval = 1
             while start_ts < end_ts:
-                # get data from the start_ts to the start_ts + 100 minutes
-                full_url = url + f'?start_ts={start_ts}&end_ts={start_ts+60*100}&period_interval={period_interval}'
-
-                headers = {"accept": "application/json"}
+                key = (series_ticker, ticker, start_ts, start_ts + 60 * 100)
+                windows.append(key)
+                markets.setdefault((series_ticker, ticker), []).append(start_ts)
 
-                response = session.get(full_url, headers=headers)
-                try:
-                    # get just the last 100 candlesticks (might be redundant step considering the above api call)
-                    candlesticks.append(response.json()['candlesticks'][:100] if len(response.json()['candlesticks']) > 100 else response.json()['candlesticks'])
-                except:
-                    print(response.text)
+                # get data from the start_ts to the start_ts + 100 minutes
+                if start_ts not in complete:
+                    missing.append((key, url + f'?start_ts={start_ts}&end_ts={start_ts+60*100}&period_interval={period_interval}'))
 
                 # increment the start_ts by 100 minutes and get the next 100 candlesticks
                 start_ts += 60 * 100
 
-        # if the number of candlesticks is greater than 1000000, break
-        # this is arbitrary; if you want more data, increase the number (and vice versa)
-        if len(candlesticks) > 1000000:
+        # if the number of candlesticks is greater than MAX_WINDOWS, break
+        if len(windows) > MAX_WINDOWS:
             break
 
-    return candlesticks
-
-# get the candlesticks
-candlesticks = get_candlesticks(get_events())
-
-# create the data and labels for training the model
-data = []
-labels = []
-for candlestick_group in candlesticks:
-    # every 60th candlestick is the label
-    [(data.append(candlestick_group[:i]), labels.append(candlestick)) for i, candlestick in enumerate(candlestick_group) if i % 59 == 0 and i != 0]
-
-# save the data and labels
-pd.DataFrame({'dict': data}).to_csv('data.csv', index=False)
-pd.DataFrame({'dict': labels}).to_csv('labels.csv', index=False)
-
+    print(f'{len(windows)} windows, {len(missing)} to fetch')
+
+    # fetch the missing windows in chunks and save each chunk as soon as it arrives
+    # if the script crashes, the next run picks up where this one left off
+    limiter = fetcher.RateLimiter(rate_limit)
+    stats = fetcher.FetchStats()
+    for i in range(0, len(missing), STORE_CHUNK):
+        chunk = missing[i:i + STORE_CHUNK]
+        fetched_at = int(time.time())
+        responses, _ = fetcher.fetch_all(session, [url for _, url in chunk], max_workers=max_workers, limiter=limiter, stats=stats)
+
+        rows = []
+        for (key, _), response in zip(chunk, responses):
+            if response is None or 'candlesticks' not in response:
+                print(response)
+                continue
+            # get just the last 100 candlesticks (might be redundant step considering the above api call)
+            rows.append((*key, response['candlesticks'][:100]))
+        store.put_windows(rows, fetched_at=fetched_at)
+    print(f'candlesticks: {stats}')
+
+    # the markets whose candlesticks are now in the store, as (series_ticker, ticker, the start_ts of every window)
+    return [(series_ticker, ticker, starts) for (series_ticker, ticker), starts in markets.items()]
+
+# candlesticks contain historial pricing data for each market
+# they are read back from the store one market at a time (so only one market's candlesticks are in memory at once), as
+# (ticker, candlesticks): every window of the market put together in time order, with one candlestick per minute
+# (neighbouring windows share a minute here and there)
+def market_candlesticks(store, markets):
+    for series_ticker, ticker, starts in markets:
+        by_minute = {}
+        for start_ts in starts:
+            for candle in store.get_window(series_ticker, ticker, start_ts) or []:
+                by_minute[candle['end_period_ts']] = candle
+        if by_minute:
+            yield ticker, [by_minute[ts] for ts in sorted(by_minute)]
+
+# an argparse type for the sample sizes, which all have to be at least 1
+def _positive(value):
+    value = int(value)
+    if value < 1:
+        raise argparse.ArgumentTypeError(f'has to be at least 1, not {value}')
+    return value
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='download candlesticks and write the training data')
+    parser.add_argument('--series', nargs='*', default=None, help='the series to download (config.SERIES by default)')
+    parser.add_argument('--store', default=STORE_PATH)
+    parser.add_argument('--out', default=DATASET_PATH)
+    parser.add_argument('--workers', type=int, default=MAX_WORKERS)
+    parser.add_argument('--rate-limit', type=float, default=RATE_LIMIT, help='requests per second (no limit by default)')
+    parser.add_argument('--window', type=_positive, default=WINDOW, help='how many candlesticks each training sample has')
+    parser.add_argument('--stride', type=_positive, default=STRIDE, help='how many candlesticks apart samples start')
+    parser.add_argument('--horizon', type=_positive, default=HORIZON, help='how many candlesticks after the window the label is')
+    args = parser.parse_args(argv)
+
+    store = candle_store.CandleStore(args.store)
+    try:
+        # get the candlesticks
+        markets = get_candlesticks(get_events(args.series), store, args.workers, args.rate_limit)
+
+        # save them, one group per market, streamed from the store
+        writer = columnar.Writer(args.out)
+        for ticker, candlesticks in market_candlesticks(store, markets):
+            writer.add(candlesticks, ticker)
+    finally:
+        store.close()
+
+    # create the data and labels for training the model
+    # each market's candlesticks are cut into windows of --window candlesticks (every --stride candlesticks), and the label
+    # is the candlestick --horizon steps after the window; the samples are just indexes into the saved columns, so nothing
+    # is copied
+    samples = columnar.window_samples(writer.lengths, window=args.window, stride=args.stride, horizon=args.horizon)
+    if not len(samples):
+        writer.abort()
+        raise SystemExit(f'no market has {args.window + args.horizon} candlesticks, so there are no samples to write '
+                         f'(try a smaller --window or --horizon)')
+
+    # save the data and labels
+    writer.close(samples)
+    print(f'{len(samples)} samples from {len(writer.lengths)} markets written to {args.out}')
+
+
+if __name__ == '__main__':
+    main()
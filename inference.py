@@ -0,0 +1,121 @@
+import os
+import json
+import time
+import pickle
+import argparse
+import torch
+import torch.nn as tnn
+from nn import KalshiCNN
+from features import FeatureSpec, legacy_spec
+
+# saving and loading the model for inference
+# there are two kinds of artifact:
+#   - a state_dict plus the config needed to rebuild the model (what nn.train saves); it is loaded with weights_only=True,
+#     so nothing is unpickled and it doesn't depend on where the class lived when it was saved
+#   - a frozen TorchScript module (what export() writes when the path ends in .pt); it is completely self-contained
+# either one can have its Linear layers dynamically quantized to int8
+# both carry the FeatureSpec the model was trained with (see features.py), so the decider builds the same inputs
+# old model.pth files (the whole pickled module) can still be loaded, and get the inputs the old decider gave them; they
+# are still loaded with weights_only=True, allowing only the classes the old model was made of (LEGACY_GLOBALS), so a
+# file that isn't what it claims to be is refused rather than unpickled
+
+# the classes an old pickled KalshiCNN is made of (it was saved from nn.py run as a script, so also as __main__.KalshiCNN)
+LEGACY_GLOBALS = [KalshiCNN, (KalshiCNN, '__main__.KalshiCNN'), tnn.Sequential, tnn.Conv1d, tnn.ReLU,
+                  tnn.AdaptiveAvgPool1d, tnn.Flatten, tnn.Linear]
+
+# the quantized copy keeps the float model it was made from (as a plain attribute, so it isn't part of the state_dict),
+# so a loaded quantized model can be saved or exported again
+def _quantize(model):
+    quantized = torch.ao.quantization.quantize_dynamic(model, {tnn.Linear}, dtype=torch.qint8)
+    object.__setattr__(quantized, 'float_model', model)
+    return quantized
+
+# save the weights and config of a trained KalshiCNN
+# (with quantize=True the float weights are saved and the int8 layers are rebuilt when the artifact is loaded)
+def save_artifact(model, path, seq_len, quantize=False, features=None):
+    features = legacy_spec(seq_len) if features is None else features
+    # a model that was quantized when it was loaded is saved as its float weights, and stays quantized
+    if hasattr(model, 'float_model'):
+        model, quantize = model.float_model, True
+    config = {'arch': 'KalshiCNN', 'seq_len': seq_len, 'in_channels': len(features), 'layers': getattr(model, 'arch', {}),
+              'quantize': quantize, 'features': features.to_config()}
+    artifact = {'config': config, 'state_dict': model.state_dict()}
+    # write to a temporary file first so a crash never leaves half a model behind
+    torch.save(artifact, path + '.tmp')
+    os.replace(path + '.tmp', path)
+
+def _from_artifact(artifact, quantize=False):
+    config = artifact['config']
+    model = KalshiCNN(config['seq_len'], config.get('in_channels', 2), **config.get('layers', {}))
+    model.load_state_dict(artifact['state_dict'])
+    model.eval()
+    return _quantize(model) if quantize or artifact['config'].get('quantize') else model
+
+# export a model for inference: a frozen TorchScript module if path ends in .pt, otherwise a state_dict artifact
+# (the feature spec is stored in the TorchScript file as an extra file)
+def export(model, path, seq_len=59, quantize=False, features=None):
+    features = legacy_spec(seq_len) if features is None else features
+    model.eval()
+    if path.endswith('.pt'):
+        if quantize:
+            model = _quantize(getattr(model, 'float_model', model))
+        example = torch.zeros(1, len(features), seq_len)
+        with torch.inference_mode():
+            scripted = torch.jit.freeze(torch.jit.trace(model, example))
+        scripted = torch.jit.optimize_for_inference(scripted)
+        torch.jit.save(scripted, path, _extra_files={'features.json': json.dumps(features.to_config())})
+    else:
+        save_artifact(model, path, seq_len, quantize, features)
+
+# load any kind of model file, ready for inference, along with the FeatureSpec its inputs have to be built with
+def load(path, quantize=False):
+    if path.endswith('.pt'):
+        extra = {'features.json': ''}
+        model = torch.jit.load(path, _extra_files=extra).eval()
+        return model, FeatureSpec.from_config(json.loads(extra['features.json'])) if extra['features.json'] else legacy_spec()
+
+    try:
+        artifact = torch.load(path, weights_only=True)
+    except pickle.UnpicklingError:
+        # an old model.pth with the whole pickled module in it (anything else still fails here)
+        print(f'{path} is not a model artifact, loading it as an old pickled KalshiCNN')
+        with torch.serialization.safe_globals(LEGACY_GLOBALS):
+            model = torch.load(path, weights_only=True)
+        model.eval()
+        return _quantize(model) if quantize else model, legacy_spec()
+
+    features = artifact['config'].get('features')
+    return _from_artifact(artifact, quantize), FeatureSpec.from_config(features) if features else legacy_spec()
+
+def load_model(path, quantize=False):
+    return load(path, quantize)[0]
+
+# how long a model takes to load and to run on a batch of the given size
+def benchmark(path, batch_size=60, runs=200, quantize=False):
+    started = time.perf_counter()
+    model, features = load(path, quantize)
+    load_time = time.perf_counter() - started
+
+    x = torch.rand(batch_size, len(features), features.window)
+    with torch.inference_mode():
+        for _ in range(10):
+            model(x)
+        started = time.perf_counter()
+        for _ in range(runs):
+            model(x)
+    return load_time, (time.perf_counter() - started) / runs
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='export KalshiCNN for inference')
+    parser.add_argument('model', help='a model saved by nn.py')
+    parser.add_argument('out', help='where to write the export (.pt for TorchScript, anything else for a state_dict artifact)')
+    parser.add_argument('--quantize', action='store_true', help='quantize the Linear layers to int8')
+    parser.add_argument('--seq-len', type=int, default=59)
+    args = parser.parse_args()
+
+    model, features = load(args.model)
+    export(model, args.out, args.seq_len, args.quantize, features)
+
+    for path in [args.model, args.out]:
+        load_time, batch_time = benchmark(path)
+        print(f'{path}: load {load_time * 1000:.1f}ms, batch of 60 {batch_time * 1000:.3f}ms')
@@ -0,0 +1,30 @@
+import sys
+import importlib
+
+# one entry point for everything the bot does:
+#   python kalshi.py fetch ...      download candlesticks and write the training data (get_data.py)
+#   python kalshi.py train ...      train the model (nn.py)
+#   python kalshi.py trade ...      run the live decider (decider.py, or sharded.py with --shards)
+#   python kalshi.py backtest ...   replay the saved candlesticks through the trading rules (backtest.py)
+# the arguments after the command go to that module's main (e.g. python kalshi.py train --help)
+# only the module for the command is imported, so e.g. trading never imports the training code
+
+COMMANDS = {
+    'fetch': 'get_data',
+    'train': 'nn',
+    'trade': 'decider',
+    'backtest': 'backtest',
+}
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv or argv[0] not in COMMANDS:
+        print(f'usage: python kalshi.py {{{",".join(COMMANDS)}}} [arguments]')
+        return 2
+    importlib.import_module(COMMANDS[argv[0]]).main(argv[1:])
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,196 @@
+import os
+import re
+import json
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+
+# counters and latency histograms for everything the bot spends time on: http calls (per endpoint), candlestick parsing,
+# model forwards and order placement
+#
+#   with metrics.span('model_forward'):       times the block into the histogram 'model_forward_seconds'
+#       ...                                   (and counts 'model_forward_errors_total' if it raises)
+#   metrics.inc('orders_total', action='buy', status='201')
+#
+# everything goes into one process-wide registry, which can be written to a file (json, or Prometheus text format if the
+# path ends in .prom) or served on /metrics for Prometheus to scrape
+# the labels of a metric are keyword arguments; keep them to a handful of values (an endpoint, not a url)
+#
+# profile() wraps a block in cProfile, for finding out where the time inside a span actually goes
+# (cProfile only sees the thread it runs on; for the worker threads use py-spy, e.g. py-spy record --threads -p <pid>)
+
+# the histogram buckets, in seconds (the last one catches everything)
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float('inf'))
+
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+        self.max = max(self.max, value)
+
+    # an estimate of the p-th percentile (the upper edge of the bucket it falls in)
+    def percentile(self, p):
+        if self.count == 0:
+            return 0.0
+        target = p / 100 * self.count
+        seen = 0
+        for edge, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= target:
+                return min(edge, self.max)
+        return self.max
+
+    def summary(self):
+        return {'count': self.count, 'mean': self.sum / self.count if self.count else 0.0, 'p50': self.percentile(50),
+                'p95': self.percentile(95), 'p99': self.percentile(99), 'max': self.max}
+
+
+class Registry:
+    def __init__(self):
+        # (name, labels) -> value / Histogram, where labels is a sorted tuple of (key, value) pairs
+        self.counters = {}
+        self.histograms = {}
+        self.lock = threading.Lock()
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    # time a block into <name>_seconds, counting <name>_errors_total if it raises
+    @contextmanager
+    def span(self, name, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        except BaseException:
+            self.inc(name + '_errors_total', **labels)
+            raise
+        finally:
+            self.observe(name + '_seconds', time.perf_counter() - started, **labels)
+
+    def reset(self):
+        with self.lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+    # everything recorded so far as a dict, e.g. {'counters': {'orders_total{action="buy"}': 3}, 'histograms': {...}}
+    def snapshot(self):
+        with self.lock:
+            return {
+                'time': time.time(),
+                'counters': {_name(name, labels): value for (name, labels), value in self.counters.items()},
+                'histograms': {_name(name, labels): h.summary() for (name, labels), h in self.histograms.items()},
+            }
+
+    # everything recorded so far in the Prometheus text format
+    def to_prometheus(self):
+        lines = []
+        with self.lock:
+            for (name, labels), value in sorted(self.counters.items()):
+                lines.append(f'{_name(name, labels)} {value}')
+            for (name, labels), h in sorted(self.histograms.items()):
+                seen = 0
+                for edge, count in zip(h.buckets, h.counts):
+                    seen += count
+                    le = '+Inf' if edge == float('inf') else repr(edge)
+                    lines.append(f'{_name(name + "_bucket", labels + (("le", le),))} {seen}')
+                lines.append(f'{_name(name + "_sum", labels)} {h.sum}')
+                lines.append(f'{_name(name + "_count", labels)} {h.count}')
+        return '\n'.join(lines) + '\n'
+
+    # write everything to a file (Prometheus text if it ends in .prom, json otherwise) without leaving half a file behind
+    def write(self, path):
+        text = self.to_prometheus() if path.endswith('.prom') else json.dumps(self.snapshot(), indent=1)
+        with open(path + '.tmp', 'w') as f:
+            f.write(text)
+        os.replace(path + '.tmp', path)
+
+    # serve /metrics for Prometheus in a background thread; returns the server (call shutdown() to stop it)
+    def serve(self, port, host='127.0.0.1'):
+        from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                data = registry.to_prometheus().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+
+def _name(name, labels):
+    if not labels:
+        return name
+    return name + '{' + ','.join(f'{k}="{v}"' for k, v in labels) + '}'
+
+
+# the endpoint of a url or path, with the tickers taken out so every market shares one metric
+# e.g. .../series/KXHIGHNY/markets/KXHIGHNY-25MAY28-T60/candlesticks?start_ts=1 -> /series/{ticker}/markets/{ticker}/candlesticks
+_TICKER_AFTER = re.compile(r'/(events|markets|series)/(?!orderbook\b|candlesticks\b)[^/?]+')
+
+
+def endpoint(url):
+    path = re.sub(r'^https?://[^/]+', '', url).split('?')[0]
+    path = path.split('/trade-api/v2', 1)[-1] or '/'
+    return _TICKER_AFTER.sub(lambda m: f'/{m.group(1)}/{{ticker}}', path)
+
+
+# the registry everything records into
+REGISTRY = Registry()
+inc = REGISTRY.inc
+observe = REGISTRY.observe
+span = REGISTRY.span
+snapshot = REGISTRY.snapshot
+to_prometheus = REGISTRY.to_prometheus
+write = REGISTRY.write
+serve = REGISTRY.serve
+
+
+# run a block under cProfile when path is given (and do nothing otherwise); the stats are added to whatever is already
+# in path, so profiling many cycles builds up one profile (read it with python -m pstats path, or snakeviz)
+@contextmanager
+def profile(path=None):
+    if not path:
+        yield
+        return
+    import cProfile
+    import pstats
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        stats = pstats.Stats(profiler)
+        if os.path.exists(path):
+            stats.add(path)
+        stats.dump_stats(path)
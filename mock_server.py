@@ -0,0 +1,309 @@
+import json
+import math
+import time
+import random
+import zlib
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+# a local stand-in for the parts of the Kalshi api the bot uses, for load and latency testing without touching production
+# run it, then set KALSHI_BASE_URL=http://127.0.0.1:<port> (see config.py) before starting get_data.py or decider.py
+#
+# the data comes from fixtures: either recorded from the real api with record_fixtures, or made up with generate_fixtures
+# (candlesticks that aren't in the fixtures are generated on the fly, so any time range can be asked for)
+# latency, 429s and 5xx errors can be injected to see how the bot copes
+
+PREFIX = '/trade-api/v2'
+
+
+# made up events and markets for the given event tickers (e.g. 'KXHIGHNY-25MAY28')
+def generate_fixtures(event_tickers, markets_per_event=10):
+    now = int(time.time())
+    fixtures = {'events': {}, 'orderbooks': {}, 'candlesticks': {}, 'positions': []}
+    for event_ticker in dict.fromkeys(event_tickers):
+        series_ticker = event_ticker.split('-')[0]
+        markets = []
+        for i in range(markets_per_event):
+            ticker = f'{event_ticker}-T{60 + i}'
+            price = _price(ticker, now // 60)
+            markets.append({
+                'ticker': ticker,
+                'event_ticker': event_ticker,
+                'status': 'active',
+                'volume': 100,
+                'open_time': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(now - 86400)),
+                'close_time': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(now + 86400)),
+                'yes_bid': price,
+                'yes_ask': price + 1,
+                'last_price': price,
+            })
+            fixtures['orderbooks'][ticker] = {'orderbook': {'yes': [[price - 1, 10], [price, 5]], 'no': [[99 - price - 2, 10], [99 - price - 1, 5]]}}
+        fixtures['events'][event_ticker] = {'event': {'event_ticker': event_ticker, 'series_ticker': series_ticker, 'markets': markets}}
+    return fixtures
+
+
+# record fixtures from the real api (the last `minutes` of candlesticks of every market of the given events)
+def record_fixtures(event_tickers, path, minutes=120):
+    import requests
+    import config
+
+    fixtures = {'events': {}, 'orderbooks': {}, 'candlesticks': {}, 'positions': []}
+    end_ts = int(time.time())
+    for event_ticker in dict.fromkeys(event_tickers):
+        event = requests.get(f'{config.API_URL}/events/{event_ticker}?with_nested_markets=true').json()
+        fixtures['events'][event_ticker] = event
+        for market in event['event']['markets']:
+            ticker = market['ticker']
+            fixtures['orderbooks'][ticker] = requests.get(f'{config.API_URL}/markets/{ticker}/orderbook').json()
+            fixtures['candlesticks'][ticker] = requests.get(
+                f'{config.API_URL}/series/{event["event"]["series_ticker"]}/markets/{ticker}/candlesticks'
+                f'?start_ts={end_ts - minutes * 60}&end_ts={end_ts}&period_interval=1').json().get('candlesticks', [])
+
+    with open(path, 'w') as f:
+        json.dump(fixtures, f)
+
+
+# a deterministic made up price for a market at a given minute
+def _price(ticker, minute):
+    phase = zlib.crc32(ticker.encode()) % 1000
+    noise = zlib.crc32(f'{ticker}{minute}'.encode()) % 3 - 1
+    return int(min(97, max(2, 50 + 30 * math.sin((minute + phase) / 97) + noise)))
+
+
+def _candle(ticker, minute):
+    price = _price(ticker, minute)
+    return {
+        'end_period_ts': minute * 60,
+        'yes_bid': {'open': price, 'high': price + 1, 'low': price - 1, 'close': price},
+        'yes_ask': {'open': price + 1, 'high': price + 2, 'low': price, 'close': price + 1},
+        'price': {'open': price, 'high': price + 1, 'low': price - 1, 'close': price},
+        'volume': zlib.crc32(f'v{ticker}{minute}'.encode()) % 20,
+        'open_interest': 1000,
+    }
+
+
+class MockKalshi(ThreadingHTTPServer):
+    daemon_threads = True
+
+    # latency is the average delay added to every response (jitter is how much it varies by)
+    # p429 / p5xx are the chances of a response being a 429 (with a Retry-After) or a 500
+    # if auto_markets is set, an event that isn't in the fixtures is made up (with that many markets) when it is asked for
+    def __init__(self, fixtures, host='127.0.0.1', port=0, latency=0.0, jitter=0.0, p429=0.0, p5xx=0.0, retry_after=1, seed=0,
+                 auto_markets=0):
+        super().__init__((host, port), _Handler)
+        self.fixtures = fixtures
+        self.markets = {}
+        self.auto_markets = auto_markets
+        for event in fixtures['events'].values():
+            self._add_event(event)
+        self.latency = latency
+        self.jitter = jitter
+        self.p429 = p429
+        self.p5xx = p5xx
+        self.retry_after = retry_after
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        # every order placed, and ticker -> position built from those orders (orders fill straight away)
+        self.orders = []
+        self.positions = {p['ticker']: p for p in fixtures.get('positions', [])}
+        self.requests = 0
+
+    @property
+    def base_url(self):
+        return f'http://{self.server_address[0]}:{self.server_address[1]}'
+
+    # serve in a background thread and return the base url to point the bot at
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self.base_url
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def _add_event(self, event):
+        for m in event['event']['markets']:
+            self.markets[m['ticker']] = (event['event']['series_ticker'], m)
+
+    def event(self, event_ticker):
+        with self.lock:
+            if event_ticker not in self.fixtures['events'] and self.auto_markets:
+                made_up = generate_fixtures([event_ticker], self.auto_markets)
+                self.fixtures['events'].update(made_up['events'])
+                self.fixtures['orderbooks'].update(made_up['orderbooks'])
+                self._add_event(made_up['events'][event_ticker])
+            return self.fixtures['events'].get(event_ticker)
+
+    # the events of a series, like GET /events?series_ticker=...; with auto_markets, a series with no events gets made up
+    # ones for today and tomorrow (e.g. KXHIGHNY-25MAY28)
+    def series_events(self, series_ticker, status=None):
+        with self.lock:
+            known = [t for t, e in self.fixtures['events'].items() if e['event']['series_ticker'] == series_ticker]
+        if not known and self.auto_markets:
+            days = [time.gmtime(time.time() + 86400 * d) for d in range(2)]
+            known = [f'{series_ticker}-{time.strftime("%y%b%d", day).upper()}' for day in days]
+            for event_ticker in known:
+                self.event(event_ticker)
+        now = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+        events = []
+        for event_ticker in sorted(known):
+            event = self.fixtures['events'][event_ticker]['event']
+            is_open = any(m['close_time'] > now for m in event['markets'])
+            if status is None or status == ('open' if is_open else 'closed'):
+                events.append(event)
+        return events
+
+    def candlesticks(self, ticker, start_ts, end_ts):
+        recorded = self.fixtures['candlesticks'].get(ticker)
+        if recorded:
+            return [c for c in recorded if start_ts < c['end_period_ts'] <= end_ts]
+        return [_candle(ticker, minute) for minute in range(start_ts // 60 + 1, end_ts // 60 + 1)]
+
+    def market(self, ticker):
+        _, market = self.markets[ticker]
+        price = _price(ticker, int(time.time()) // 60)
+        return dict(market, yes_bid=price, yes_ask=price + 1, last_price=price)
+
+    def place_order(self, body):
+        with self.lock:
+            order = dict(body, order_id=f'mock-{len(self.orders)}', status='executed', remaining_count=0, created_ts=int(time.time()))
+            self.orders.append(order)
+            position = self.positions.setdefault(body['ticker'], {'ticker': body['ticker'], 'position': 0, 'market_exposure': 0})
+            sign = 1 if body['action'] == 'buy' else -1
+            position['position'] += sign * body['count']
+            position['market_exposure'] += sign * body['count'] * body['yes_price']
+            return order
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # keep-alive, like the real api
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body, headers=None):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    # the injected latency and errors; returns True if the request was answered with an error
+    def _inject(self):
+        server = self.server
+        with server.lock:
+            server.requests += 1
+            delay = max(0.0, server.latency + server.rng.uniform(-server.jitter, server.jitter))
+            roll = server.rng.random()
+        if delay:
+            time.sleep(delay)
+        if roll < server.p429:
+            self._send(429, {'error': 'too many requests'}, {'Retry-After': str(server.retry_after)})
+            return True
+        if roll < server.p429 + server.p5xx:
+            self._send(500, {'error': 'internal server error'})
+            return True
+        return False
+
+    def do_GET(self):
+        if self._inject():
+            return
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        parts = url.path[len(PREFIX):].strip('/').split('/') if url.path.startswith(PREFIX) else []
+        server = self.server
+
+        try:
+            # /events?series_ticker=&status=&limit=&cursor=
+            if parts == ['events']:
+                events = server.series_events(query['series_ticker'][0], query.get('status', [None])[0])
+                limit = int(query.get('limit', ['100'])[0])
+                start = int(query.get('cursor', ['0'])[0] or 0)
+                cursor = str(start + limit) if start + limit < len(events) else ''
+                return self._send(200, {'events': events[start:start + limit], 'cursor': cursor})
+
+            # /events/{event_ticker}
+            if len(parts) == 2 and parts[0] == 'events':
+                event = server.event(parts[1])
+                return self._send(200, event) if event else self._send(404, {'error': 'not found'})
+
+            # /markets?tickers=a,b,c
+            if parts == ['markets']:
+                tickers = query.get('tickers', [''])[0].split(',')
+                return self._send(200, {'markets': [server.market(t) for t in tickers if t in server.markets], 'cursor': ''})
+
+            # /markets/{ticker}
+            if len(parts) == 2 and parts[0] == 'markets':
+                if parts[1] not in server.markets:
+                    return self._send(404, {'error': 'not found'})
+                return self._send(200, {'market': server.market(parts[1])})
+
+            # /markets/{ticker}/orderbook
+            if len(parts) == 3 and parts[0] == 'markets' and parts[2] == 'orderbook':
+                orderbook = server.fixtures['orderbooks'].get(parts[1])
+                return self._send(200, orderbook) if orderbook else self._send(404, {'error': 'not found'})
+
+            # /series/{series_ticker}/markets/{ticker}/candlesticks
+            if len(parts) == 5 and parts[0] == 'series' and parts[4] == 'candlesticks':
+                start_ts = int(query['start_ts'][0])
+                end_ts = min(int(query['end_ts'][0]), int(time.time()))
+                return self._send(200, {'ticker': parts[3], 'candlesticks': server.candlesticks(parts[3], start_ts, end_ts)})
+
+            # /portfolio/orders?min_ts=&status=&cursor=
+            if parts == ['portfolio', 'orders']:
+                min_ts = int(query.get('min_ts', ['0'])[0])
+                status = query.get('status', [None])[0]
+                limit = int(query.get('limit', ['100'])[0])
+                start = int(query.get('cursor', ['0'])[0] or 0)
+                with server.lock:
+                    orders = [o for o in server.orders if o['created_ts'] >= min_ts and status in (None, o['status'])]
+                page = orders[start:start + limit]
+                cursor = str(start + limit) if start + limit < len(orders) else ''
+                return self._send(200, {'orders': page, 'cursor': cursor})
+
+            # /portfolio/positions
+            if parts == ['portfolio', 'positions']:
+                with server.lock:
+                    positions = [dict(p) for p in server.positions.values()]
+                return self._send(200, {'market_positions': positions, 'cursor': ''})
+        except (KeyError, ValueError) as e:
+            return self._send(400, {'error': str(e)})
+
+        self._send(404, {'error': 'not found'})
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        if self._inject():
+            return
+        if self.path.rstrip('/') == PREFIX + '/portfolio/orders':
+            return self._send(201, {'order': self.server.place_order(body)})
+        self._send(404, {'error': 'not found'})
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='serve a mock Kalshi api')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--fixtures', help='a json file from record_fixtures (made up markets are used if not given)')
+    parser.add_argument('--events', nargs='*', default=['KXHIGHCHI-25MAY28', 'KXHIGHDEN-25MAY28', 'KXHIGHNY-25MAY28', 'KXHIGHLAX-25MAY28', 'KXHIGHAUS-25MAY28', 'KXHIGHPHIL-25MAY28'])
+    parser.add_argument('--markets-per-event', type=int, default=10)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--p429', type=float, default=0.0)
+    parser.add_argument('--p5xx', type=float, default=0.0)
+    args = parser.parse_args()
+
+    if args.fixtures:
+        with open(args.fixtures) as f:
+            fixtures = json.load(f)
+    else:
+        fixtures = generate_fixtures(args.events, args.markets_per_event)
+
+    server = MockKalshi(fixtures, port=args.port, latency=args.latency, jitter=args.jitter, p429=args.p429, p5xx=args.p5xx)
+    print(f'serving on {server.base_url}')
+    server.serve_forever()
@@ -1,60 +1,186 @@
+import os
+import time
+import argparse
 import torch.nn as nn
 import torch
-import process_data as ld
-from torch.utils.data import DataLoader
-from tqdm import tqdm
-import matplotlib.pyplot as plt
+import metrics
 
 # define the model
+# (this module only defines the model when it is imported; the training data is only loaded by train(), so importing
+# KalshiCNN for inference costs nothing)
+# widths / kernels are the output channels and kernel size of each convolution and hidden the size of the hidden layer
+# (the defaults are the original model, and sweep.py tries others)
 class KalshiCNN(nn.Module):
-    def __init__(self, seq_len):
+    def __init__(self, seq_len, in_channels=2, widths=(32, 64), kernels=(5, 3), hidden=50):
         super().__init__()
-        self.features = nn.Sequential(
-            nn.Conv1d(in_channels=2, out_channels=32, kernel_size=5, padding=2),
-            nn.ReLU(),
-            nn.Conv1d(32, 64, kernel_size=3, padding=1),
-            nn.ReLU(),
-            nn.AdaptiveAvgPool1d(1)
-        )
+        self.arch = {'widths': list(widths), 'kernels': list(kernels), 'hidden': hidden}
+        layers = []
+        for width, kernel in zip(widths, kernels):
+            layers += [nn.Conv1d(in_channels, width, kernel_size=kernel, padding=kernel // 2), nn.ReLU()]
+            in_channels = width
+        self.features = nn.Sequential(*layers, nn.AdaptiveAvgPool1d(1))
         self.regressor = nn.Sequential(
             nn.Flatten(),
-            nn.Linear(64, 50),
+            nn.Linear(in_channels, hidden),
             nn.ReLU(),
-            nn.Linear(50, 1)
+            nn.Linear(hidden, 1)
         )
 
-    def forward(self, x):      
+    def forward(self, x):
         x = self.features(x)
         return self.regressor(x)
 
-train_ds = ld.KalshiDataset()
-train_dl = DataLoader(train_ds, batch_size=32, shuffle=True)
+# how many threads torch should use for the math: every core, minus the ones the DataLoader workers are using
+def thread_policy(num_workers):
+    return max(1, (os.cpu_count() or 1) - num_workers)
+
+# mean squared and absolute error of the model over the given samples (in time order, batch_size at a time)
+def evaluate(model, dataset, indices, batch_size=4096, device='cpu'):
+    model.eval()
+    squared = 0.0
+    absolute = 0.0
+    with torch.inference_mode():
+        for i in range(0, len(indices), batch_size):
+            batch, label = dataset[indices[i:i + batch_size]]
+            pred = model(batch.to(device)).squeeze(1).float()
+            diff = pred - label.to(device).squeeze(1)
+            squared += (diff ** 2).sum().item()
+            absolute += diff.abs().sum().item()
+    n = max(1, len(indices))
+    return squared / n, absolute / n
+
+# write a checkpoint without ever leaving a half-written file behind
+def save_checkpoint(state, path):
+    torch.save(state, path + '.tmp')
+    os.replace(path + '.tmp', path)
+
+def train(data_path='../large_files/dataset', out='model.pth', epochs=400, batch_size=1024, lr=1e-3, num_workers=0,
+          prefetch_factor=2, bf16=False, compile=False, threads=None, device='cpu', val_fraction=0.1, patience=20,
+          min_delta=0.0, checkpoint='checkpoint.pth', checkpoint_every=1, resume=False, channels=None, arch=None,
+          show_progress=True):
+    import process_data as ld
+    import features
+    from torch.utils.data import DataLoader, BatchSampler, SubsetRandomSampler
+    from tqdm import tqdm
+
+    torch.set_num_threads(threads or thread_policy(num_workers))
+
+    # the packed dataset hands out whole batches with one slice of a memory-mapped array, and the workers share its pages
+    # the inputs are built by features.py (the same code the decider uses), normalized with stats fitted on the dataset
+    train_ds = ld.KalshiDataset(data_path, packed=True, spec=features.fit_dataset(data_path, channels, val_fraction=val_fraction))
+    # the newest samples are held out for validation
+    train_idx, val_idx = train_ds.split(val_fraction)
+    loader_args = {'num_workers': num_workers, 'pin_memory': device.startswith('cuda')}
+    if num_workers > 0:
+        loader_args.update(prefetch_factor=prefetch_factor, persistent_workers=True)
+    train_dl = DataLoader(train_ds, sampler=BatchSampler(SubsetRandomSampler(train_idx.tolist()), batch_size=batch_size, drop_last=False),
+                          batch_size=None, **loader_args)
+
+    model = KalshiCNN(train_ds.seq_len, len(train_ds.spec), **(arch or {})).to(device)
+    loss_fn   = nn.MSELoss()
+    optimizer = torch.optim.Adam(model.parameters(), lr=lr)
+
+    # everything needed to carry on where a crashed run left off
+    state = {'epoch': -1, 'best_val': float('inf'), 'best_state': None, 'bad_epochs': 0, 'history': []}
+    if resume and os.path.exists(checkpoint):
+        saved = torch.load(checkpoint, weights_only=True)
+        model.load_state_dict(saved['model'])
+        optimizer.load_state_dict(saved['optimizer'])
+        state = saved['state']
+        print(f'resuming after epoch {state["epoch"]}')
 
-model = KalshiCNN(train_ds.seq_len)
-loss_fn   = nn.MSELoss()
-optimizer = torch.optim.Adam(model.parameters(), lr=1e-3)
+    # torch.compile only exists on torch 2+, and the uncompiled model is the one that gets saved
+    step_model = torch.compile(model) if compile and hasattr(torch, 'compile') else model
 
-if __name__ == "__main__":
-    losses = []
     # train the model
-    for epoch in tqdm(range(400)):
+    progress = tqdm(range(state['epoch'] + 1, epochs), initial=state['epoch'] + 1, total=epochs, disable=not show_progress)
+    for epoch in progress:
         model.train()
+        started = time.perf_counter()
+        seen = 0
+        total_loss = 0.0
         for batch, label in train_dl:
-            pred = model(batch).squeeze(1)
-            loss = loss_fn(pred, label.squeeze(1))
+            batch = batch.to(device, non_blocking=True)
+            label = label.to(device, non_blocking=True)
+            # bf16 autocast speeds up the convolutions on CPUs that support it
+            with torch.autocast(device_type=device.split(':')[0], dtype=torch.bfloat16, enabled=bf16):
+                pred = step_model(batch).squeeze(1)
+                loss = loss_fn(pred.float(), label.squeeze(1))
             optimizer.zero_grad()
             loss.backward()
             optimizer.step()
-    
-        losses.append(loss.item())
+            seen += len(batch)
+            total_loss += loss.item() * len(batch)
 
-    torch.save(model, 'model.pth')
+        train_loss = total_loss / max(1, seen)
+        samples_per_sec = seen / (time.perf_counter() - started)
+        metrics.observe('train_epoch_seconds', time.perf_counter() - started)
+        metrics.inc('train_samples_total', seen)
+        val_loss, val_mae = evaluate(model, train_ds, val_idx, device=device) if len(val_idx) else (train_loss, float('nan'))
+        state['history'].append({'epoch': epoch, 'train_loss': train_loss, 'val_loss': val_loss, 'val_mae': val_mae,
+                                 'samples_per_sec': samples_per_sec})
+        progress.set_postfix(train=f'{train_loss:.4f}', val=f'{val_loss:.4f}', mae=f'{val_mae:.3f}', samples_per_sec=f'{samples_per_sec:.0f}')
+
+        # keep the best model so far, and stop once the validation loss hasn't improved for `patience` epochs
+        if val_loss < state['best_val'] - min_delta:
+            state['best_val'] = val_loss
+            state['best_state'] = {k: v.detach().clone() for k, v in model.state_dict().items()}
+            state['bad_epochs'] = 0
+        else:
+            state['bad_epochs'] += 1
+        state['epoch'] = epoch
+
+        stop = state['bad_epochs'] >= patience
+        if checkpoint and (stop or (epoch + 1) % checkpoint_every == 0 or epoch == epochs - 1):
+            save_checkpoint({'model': model.state_dict(), 'optimizer': optimizer.state_dict(), 'state': state}, checkpoint)
+        if stop:
+            print(f'stopping early after epoch {epoch}, best validation loss {state["best_val"]:.4f}')
+            break
+
+    if state['best_state'] is not None:
+        model.load_state_dict(state['best_state'])
+
+    # save the weights and config rather than the pickled module (see inference.py)
+    from inference import save_artifact
+    save_artifact(model, out, train_ds.seq_len, features=train_ds.spec)
+    return model, [h['train_loss'] for h in state['history']]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='train KalshiCNN')
+    parser.add_argument('--data', default='../large_files/dataset')
+    parser.add_argument('--out', default='model.pth')
+    parser.add_argument('--epochs', type=int, default=400)
+    parser.add_argument('--batch-size', type=int, default=1024)
+    parser.add_argument('--lr', type=float, default=1e-3)
+    parser.add_argument('--workers', type=int, default=0)
+    parser.add_argument('--prefetch', type=int, default=2)
+    parser.add_argument('--bf16', action='store_true', help='train under bf16 autocast')
+    parser.add_argument('--compile', action='store_true', help='use torch.compile if it is available')
+    parser.add_argument('--threads', type=int, default=None)
+    parser.add_argument('--device', default='cpu')
+    parser.add_argument('--val-fraction', type=float, default=0.1, help='the newest fraction of samples to validate on')
+    parser.add_argument('--patience', type=int, default=20, help='epochs without improvement before stopping')
+    parser.add_argument('--min-delta', type=float, default=0.0)
+    parser.add_argument('--checkpoint', default='checkpoint.pth')
+    parser.add_argument('--checkpoint-every', type=int, default=1)
+    parser.add_argument('--resume', action='store_true', help='carry on from the checkpoint')
+    parser.add_argument('--channels', nargs='*', default=None, help='the input channels (see features.CHANNELS)')
+    args = parser.parse_args(argv)
+
+    model, losses = train(args.data, args.out, args.epochs, args.batch_size, args.lr, args.workers, args.prefetch,
+                          args.bf16, args.compile, args.threads, args.device, args.val_fraction, args.patience,
+                          args.min_delta, args.checkpoint, args.checkpoint_every, args.resume, args.channels)
 
     # uncomment to see learning ability
     '''
-    plt.plot(range(400), losses)
+    import matplotlib.pyplot as plt
+    plt.plot(range(len(losses)), losses)
     plt.xlabel('Epochs')
     plt.ylabel('Loss')
     plt.title('Loss vs Epochs')
     plt.show()
-    '''
\ No newline at end of file
+    '''
+
+
+if __name__ == '__main__':
+    main()
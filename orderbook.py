@@ -0,0 +1,78 @@
+import numpy as np
+
+# a parsed orderbook, built once per snapshot and shared by every check that needs it
+# the api's orderbook only has bids: 'yes' is [[price, quantity], ...] for yes contracts and 'no' the same for no
+# contracts; a bid for no at p is the same as an offer to sell yes at 100 - p, so the no side is the yes asks
+# both sides are kept as arrays indexed by price in cents (0 to 100), along with running totals, so the best prices,
+# the depth at or through a price and the cost of filling a given size are all a lookup or two instead of a walk
+# through the levels
+
+PRICES = np.arange(101)
+
+
+class OrderBook:
+    # yes / no are the api's lists of [price, quantity] levels (either can be empty or None)
+    def __init__(self, yes=None, no=None):
+        # quantity bid for yes at each price, and quantity offered (to sell yes) at each price
+        self.bids = _levels(yes)
+        self.asks = _levels(no)[::-1].copy()
+
+        # asks, cheapest first: how many contracts (and how many cents) are offered at or below each price
+        self.ask_through = np.cumsum(self.asks)
+        self.ask_cost = np.cumsum(self.asks * PRICES)
+        # bids, highest first: how many contracts (and how many cents) are bid at or above each price
+        self.bid_through = np.cumsum(self.bids[::-1])[::-1]
+        self.bid_value = np.cumsum((self.bids * PRICES)[::-1])[::-1]
+
+        bid_prices = np.flatnonzero(self.bids)
+        ask_prices = np.flatnonzero(self.asks)
+        self.best_bid = int(bid_prices[-1]) if len(bid_prices) else None
+        self.best_ask = int(ask_prices[0]) if len(ask_prices) else None
+
+    # the 'orderbook' part of the api's response
+    @classmethod
+    def from_api(cls, orderbook):
+        return cls(orderbook.get('yes'), orderbook.get('no'))
+
+    @property
+    def spread(self):
+        if self.best_bid is None or self.best_ask is None:
+            return None
+        return self.best_ask - self.best_bid
+
+    # how many contracts are bid ('bid') or offered ('ask') at exactly this price
+    def depth(self, side, price):
+        return int((self.bids if side == 'bid' else self.asks)[price])
+
+    # how many contracts can be bought at or below this price (side 'ask'), or sold at or above it (side 'bid')
+    def depth_through(self, side, price):
+        return int((self.bid_through if side == 'bid' else self.ask_through)[price])
+
+    # the limit price that would fill count contracts right away: the highest ask needed to buy them, or the lowest
+    # bid needed to sell them (None if the book isn't deep enough)
+    def fill_price(self, action, count):
+        if action == 'buy':
+            price = int(np.searchsorted(self.ask_through, count))
+            return price if price <= 100 else None
+        # bid_through only goes down as the price goes up, so count the prices that still have enough
+        price = int(np.count_nonzero(self.bid_through >= count)) - 1
+        return price if price >= 0 and count > 0 else None
+
+    # the average price of filling count contracts against the book (None if it isn't deep enough)
+    def vwap(self, action, count):
+        price = self.fill_price(action, count)
+        if price is None or count <= 0:
+            return None
+        if action == 'buy':
+            before, cost = (self.ask_through[price - 1], self.ask_cost[price - 1]) if price > 0 else (0, 0)
+        else:
+            before, cost = (self.bid_through[price + 1], self.bid_value[price + 1]) if price < 100 else (0, 0)
+        return float(cost + (count - before) * price) / count
+
+
+def _levels(levels):
+    quantities = np.zeros(101, dtype=np.int64)
+    if levels:
+        levels = np.asarray(levels, dtype=np.int64).reshape(-1, 2)
+        np.add.at(quantities, np.clip(levels[:, 0], 0, 100), levels[:, 1])
+    return quantities
@@ -0,0 +1,212 @@
+import json
+import time
+import threading
+from dataclasses import dataclass, field
+import metrics
+
+# keeps track of every order the bot places, by client_order_id
+# an order is recorded as 'pending' before it is sent, then takes the status the api gives it ('resting', 'executed',
+# 'canceled') or 'failed' if the api rejected it; reconcile() brings every open order up to date with one batched
+# poll of /portfolio/orders instead of asking about each order on its own
+# the decider asks "is there an open buy/sell on this market?" every cycle, so the open orders are also indexed by
+# (ticker, action) and those questions don't have to look through every order
+
+OPEN = ('pending', 'resting')
+
+
+@dataclass
+class Order:
+    client_order_id: str
+    ticker: str
+    action: str
+    price: int
+    count: int
+    placed_at: float
+    expires_at: float
+    status: str = 'pending'
+    # the api's own id for the order, once it has answered
+    order_id: str = None
+    # how many contracts are still waiting to be filled
+    remaining: int = None
+    # the status code and body of the api's answer to the order
+    response: tuple = field(default=None, repr=False)
+
+    @property
+    def is_open(self):
+        return self.status in OPEN
+
+
+# a frozen copy of which markets have open orders, small enough to send to another process
+class OpenOrders:
+    def __init__(self, keys=()):
+        self.keys = frozenset(keys)
+
+    def has_open(self, ticker, action=None):
+        if action is None:
+            return (ticker, 'buy') in self.keys or (ticker, 'sell') in self.keys
+        return (ticker, action) in self.keys
+
+
+class OrderManager:
+    # expiry is how long orders rest for (client.make_request sends a 3 minute expiration_ts)
+    # closed orders are forgotten after keep seconds
+    def __init__(self, client, expiry=180, keep=3600):
+        self.client = client
+        self.expiry = expiry
+        self.keep = keep
+        # client_order_id -> Order
+        self.orders = {}
+        # (ticker, action) -> client_order_ids of the open orders
+        self.open = {}
+        # orders are placed from several threads at once
+        self.lock = threading.Lock()
+
+    # place an order through the client and track it; returns the client's (status code, text)
+    def place(self, ticker, action, price, count=1):
+        order = self._record(ticker, action, price, count)
+        # if this raises (e.g. a timeout) the order may or may not have reached the api, so it stays pending until
+        # reconcile() finds out
+        result = self.client.make_request(ticker, action, price, count=count, client_order_id=order.client_order_id)
+        self._settle(order, result)
+        return result
+
+    # place many orders in one concurrent batch (see Client.place_orders) and track them all
+    # orders is a list of (ticker, action, price, count); returns the (status code, text) of each, in the same order
+    def place_many(self, orders):
+        recorded = [self._record(*order) for order in orders]
+        with metrics.span('order_batch'):
+            results = self.client.place_orders([(o.ticker, o.action, o.price, o.count, o.client_order_id) for o in recorded])
+        for order, result in zip(recorded, results):
+            self._settle(order, result)
+        return results
+
+    def _record(self, ticker, action, price, count=1):
+        now = time.time()
+        order = Order(self.client.new_order_id(), ticker, action, price, count, now, now + self.expiry, remaining=count)
+        with self.lock:
+            self.orders[order.client_order_id] = order
+            self.open.setdefault((ticker, action), set()).add(order.client_order_id)
+        return order
+
+    # take the api's answer to an order (a status code of None means it couldn't be sent, so it stays pending)
+    def _settle(self, order, result):
+        status_code, text = result
+        metrics.inc('orders_total', action=order.action, status=status_code if status_code is not None else 'error')
+        with self.lock:
+            order.response = result
+            if status_code is None:
+                return
+            if 200 <= status_code < 300:
+                self._update(order, _parse_order(text))
+            else:
+                self._set_status(order, 'failed')
+
+    # bring every open order up to date with one poll of /portfolio/orders
+    def reconcile(self, now=None):
+        with metrics.span('order_reconcile'):
+            self._reconcile(time.time() if now is None else now)
+
+    def _reconcile(self, now):
+        with self.lock:
+            open_orders = [o for o in self.orders.values() if o.is_open]
+        if open_orders:
+            reported = {o.get('client_order_id'): o for o in self.client.get_orders(min_ts=int(min(o.placed_at for o in open_orders)) - 60)}
+        else:
+            reported = {}
+
+        with self.lock:
+            for order in open_orders:
+                if order.client_order_id in reported:
+                    self._update(order, reported[order.client_order_id])
+                # an order the api doesn't know about after it would have expired never made it there
+                elif now > order.expires_at:
+                    self._set_status(order, 'expired')
+
+            # forget closed orders that are old enough not to matter any more
+            for client_order_id in [k for k, o in self.orders.items() if not o.is_open and now - o.placed_at > self.keep]:
+                del self.orders[client_order_id]
+
+    # whether there is an open order for the market (optionally only buys or only sells)
+    def has_open(self, ticker, action=None):
+        if action is None:
+            return bool(self.open.get((ticker, 'buy'))) or bool(self.open.get((ticker, 'sell')))
+        return bool(self.open.get((ticker, action)))
+
+    # how many contracts of the market are still waiting in open orders
+    def open_count(self, ticker, action):
+        with self.lock:
+            return sum(self.orders[k].remaining or 0 for k in self.open.get((ticker, action), ()))
+
+    # which markets have open orders right now (see OpenOrders)
+    def view(self):
+        with self.lock:
+            return OpenOrders(self.open)
+
+    def open_orders(self):
+        with self.lock:
+            return [o for o in self.orders.values() if o.is_open]
+
+    def get(self, client_order_id):
+        return self.orders.get(client_order_id)
+
+    # the number of orders in each status
+    def summary(self):
+        counts = {}
+        with self.lock:
+            for order in self.orders.values():
+                counts[order.status] = counts.get(order.status, 0) + 1
+        return counts
+
+    def _update(self, order, reported):
+        if not reported:
+            return
+        order.order_id = reported.get('order_id', order.order_id)
+        order.remaining = reported.get('remaining_count', order.remaining)
+        self._set_status(order, reported.get('status', order.status))
+
+    def _set_status(self, order, status):
+        order.status = status
+        if not order.is_open:
+            ids = self.open.get((order.ticker, order.action))
+            if ids is not None:
+                ids.discard(order.client_order_id)
+                if not ids:
+                    del self.open[(order.ticker, order.action)]
+
+
+def _parse_order(text):
+    try:
+        return json.loads(text).get('order')
+    except ValueError:
+        return None
+
+
+# the whole portfolio as the buys of a cycle see it: what is held plus what is waiting in open buys
+# buys are let through one at a time until they would take it past max_exposure (cents) or max_positions (markets)
+# (0 means no limit; sells always go through, they only make the portfolio smaller)
+class RiskView:
+    def __init__(self, holdings, open_orders, max_exposure=0, max_positions=0):
+        self.max_exposure = max_exposure
+        self.max_positions = max_positions
+        self.exposure = sum(h.posn * h.price for h in holdings.values())
+        self.markets = set(holdings)
+        for order in open_orders:
+            if order.action == 'buy':
+                self.exposure += (order.remaining or 0) * order.price
+                self.markets.add(order.ticker)
+
+    def allow_buy(self, ticker, price, count=1):
+        if self.max_exposure and self.exposure + price * count > self.max_exposure:
+            return False
+        if self.max_positions and ticker not in self.markets and len(self.markets) >= self.max_positions:
+            return False
+        self.exposure += price * count
+        self.markets.add(ticker)
+        return True
+
+    # the buys (ticker, price) that fit, in the order given
+    def filter_buys(self, buys):
+        allowed = [(ticker, price) for ticker, price in buys if self.allow_buy(ticker, price)]
+        if len(allowed) < len(buys):
+            metrics.inc('buys_blocked_total', len(buys) - len(allowed))
+        return allowed
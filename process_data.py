@@ -1,45 +1,99 @@
 import torch
 from torch.utils.data import Dataset
-import pandas as pd
+import os
 import json
-import ast
+import numpy as np
+import columnar
+import features
 
-from cryptography.hazmat.primitives import serialization
-from cryptography.hazmat.backends import default_backend
-import requests
-import datetime
 
-from cryptography.hazmat.primitives import hashes
-from cryptography.hazmat.primitives.asymmetric import padding, rsa
-from cryptography.exceptions import InvalidSignature
+# pre-tensorize every sample of a dataset into one contiguous padded float32 array (saved next to the dataset)
+# x.npy holds the inputs built by the feature spec (samples, channels, window), y.npy the labels and lengths.npy how
+# many candlesticks of each input are real; features.json records the spec, so a different spec packs again
+def pack(path, spec, chunk=65536):
+    data = columnar.load(path)
+    samples = data['samples']
+    close = data['yes_bid_close']
+    keys = features.dataset_keys(data)
+    lengths = np.minimum(samples[:, 1] - samples[:, 0], spec.window).astype(np.int64)
+
+    out = os.path.join(path, 'packed')
+    os.makedirs(out, exist_ok=True)
+    x = np.lib.format.open_memmap(os.path.join(out, 'x.npy'), mode='w+', dtype=np.float32, shape=(len(samples), len(spec), spec.window))
+    for i in range(0, len(samples), chunk):
+        part = samples[i:i + chunk]
+        x[i:i + chunk] = spec.build(data, part[:, 0], part[:, 1], None if keys is None else keys[part[:, 1] - 1])
+    x.flush()
+
+    np.save(os.path.join(out, 'y.npy'), np.asarray(close[samples[:, 2]], dtype=np.float32).reshape(-1, 1))
+    np.save(os.path.join(out, 'lengths.npy'), lengths)
+    with open(os.path.join(out, 'features.json'), 'w') as f:
+        json.dump(spec.to_config(), f)
+
+# whether the packed arrays were built from the current dataset with the given spec
+def _is_packed(path, spec):
+    out = os.path.join(path, 'packed')
+    lengths = os.path.join(out, 'lengths.npy')
+    if not os.path.exists(lengths) or not os.path.exists(os.path.join(out, 'features.json')):
+        return False
+    # pack again if the dataset has been written since it was last packed
+    if os.path.getmtime(lengths) < os.path.getmtime(os.path.join(path, 'samples.npy')):
+        return False
+    with open(os.path.join(out, 'features.json')) as f:
+        return features.FeatureSpec.from_config(json.load(f)) == spec
 
 class KalshiDataset(Dataset):
-    def __init__(self):
-        self.data_df = pd.read_csv('../large_files/data.csv')
-        self.label_df = pd.read_csv('../large_files/labels.csv')
-        self.seq_len = self.data_df['dict'].map(lambda s: len(ast.literal_eval(s))).max()
+    # path is a directory written by columnar.write (get_data.py), it is memory-mapped rather than parsed
+    # with packed=True, every sample is pre-tensorized once (see pack) and __getitem__ is just a slice of a memory-mapped array,
+    # so DataLoader workers share the same pages instead of each holding a copy
+    # spec is the features.FeatureSpec that builds the inputs; by default the default channels, normalized with stats
+    # fitted on (and cached next to) the dataset
+    def __init__(self, path='../large_files/dataset', packed=False, repack=False, spec=None):
+        self.data = columnar.load(path)
+        self.samples = self.data['samples']
+        self.close = self.data['yes_bid_close']
+        self.spec = features.fit_dataset(path, data=self.data) if spec is None else spec
+        self.seq_len = self.spec.window
+        self.keys = features.dataset_keys(self.data)
+        self.packed = packed
+
+        if packed:
+            out = os.path.join(path, 'packed')
+            if repack or not _is_packed(path, self.spec):
+                pack(path, self.spec)
+            # copy-on-write maps are writable (so torch doesn't complain) but are never written back to disk
+            self.x = np.load(os.path.join(out, 'x.npy'), mmap_mode='c')
+            self.y = np.load(os.path.join(out, 'y.npy'), mmap_mode='c')
+            self.lengths = np.load(os.path.join(out, 'lengths.npy'), mmap_mode='c')
 
     def __len__(self):
-        return len(self.label_df)
+        return len(self.samples)
 
-    @staticmethod
-    def _parse_dict(s):
-        out = []
-        for d in ast.literal_eval(s):
-            out.extend([d['yes_bid']['close']])
-        return out
+    # split the samples by time (see features.time_split); the newest val_fraction of them are the validation set
+    def split(self, val_fraction=0.1):
+        return features.time_split(self.data, val_fraction)[:2]
 
+    # fetch a whole batch with one fancy-index (only for packed datasets)
+    # the mask is True wherever the input holds a real value rather than padding
+    def get_batch(self, indices):
+        indices = np.asarray(indices)
+        x = torch.from_numpy(self.x[indices])
+        y = torch.from_numpy(self.y[indices])
+        mask = torch.from_numpy(np.ascontiguousarray(self.spec.mask(self.lengths[indices])))
+        return x, y, mask
+
+    # for packed datasets idx can also be a list of indexes, which returns a whole batch
+    # (use a BatchSampler with batch_size=None in the DataLoader to get batches this way)
     def __getitem__(self, idx):
-        # pad the data to the correct length using 0.0
-        numeric = self._parse_dict(self.data_df.iloc[idx]['dict'])
-        pad_needed = (self.seq_len*2 - len(numeric))
-        numeric.extend([0.0]*pad_needed)
-        x = torch.tensor(numeric, dtype=torch.float32).view(2, self.seq_len)
+        if self.packed:
+            return torch.from_numpy(self.x[idx]), torch.from_numpy(self.y[idx])
+
+        start, end, label = self.samples[idx]
+
+        # the same inputs pack() would have built
+        x = torch.from_numpy(self.spec.build(self.data, [start], [end], None if self.keys is None else self.keys[[end - 1]])[0])
 
         # get the labels for the data
-        lbl_dict = ast.literal_eval(self.label_df.iloc[idx]['dict'])
-        y = torch.tensor([lbl_dict['yes_bid']['close']], dtype=torch.float32)
+        y = torch.tensor([self.close[label]], dtype=torch.float32)
 
         return x, y
-
-data = KalshiDataset()
\ No newline at end of file
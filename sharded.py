@@ -0,0 +1,231 @@
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+import torch
+import torch.multiprocessing as mp
+import config
+import fetcher
+import metrics
+import strategy
+from client import Client
+from orders import OrderManager, RiskView
+from inference import load
+
+# the decider split across processes, so the cycle time stays flat as series are added
+# run it with python decider.py --shards N (or python kalshi.py trade --shards N)
+# the series are shared out between the workers; each worker finds its own series' events, keeps its own candlestick
+# buffers, takes its own snapshot and runs the model over its own markets
+# the coordinator (this process) owns everything that has to be seen as a whole: the Client (so there is one order
+# path and one connection pool for orders), the OrderManager, the positions and the portfolio limits (orders.RiskView)
+#
+# the model is loaded once by the coordinator and its weights are moved into shared memory, so every worker reads the
+# same copy instead of loading its own (a TorchScript .pt export can't be shared that way, so each worker loads that)
+#
+# a cycle has two steps so the slow parts overlap:
+#   1. every worker fetches its snapshot and runs the model while the coordinator fetches the positions and orders
+#   2. the coordinator sends the positions and open orders out, every worker decides, and the coordinator checks the
+#      buys against the portfolio limits and places all the orders in one batch
+
+# how long the coordinator waits for the workers at each step before going on without them
+STARTUP_TIMEOUT = 120
+PREPARE_TIMEOUT = 30
+DECIDE_TIMEOUT = 5
+# and how long it waits for the positions, the order reconcile and the orders (like the decider's)
+POSITIONS_TIMEOUT = 10
+ORDER_TIMEOUT = 10
+
+
+# share the series out between the workers: sorted, then dealt round-robin, so every worker gets work and the same
+# list of series always splits the same way (no more workers than series are started)
+def assign(series, shards):
+    series = sorted(set(series))
+    return [series[i::shards] for i in range(min(shards, len(series)))]
+
+
+# a worker process: model is the coordinator's model in shared memory (None to load model_path here instead)
+def _worker(conn, series, model, spec, model_path, request_timeout):
+    # the workers share the machine's cores, so each one sticks to one thread
+    torch.set_num_threads(1)
+    from universe import MarketUniverse
+    from candle_buffer import CandleBuffers
+    from snapshot import take_snapshot
+
+    if model is None:
+        model, spec = load(model_path)
+    session = fetcher.make_session(pool_size=20)
+    universe = MarketUniverse(session, series)
+    buffers = CandleBuffers(size=59)
+    # the snapshot and predictions of the last prepare, and the cycle they belong to
+    snapshot = None
+    predictions = {}
+    prepared = None
+    conn.send((0, 'ready', {}))
+
+    while True:
+        message = conn.recv()
+        if message is None:
+            return
+        step, cycle = message[0], message[1]
+        try:
+            if step == 'prepare':
+                # forget the last cycle first, so a prepare that fails can't leave its data behind for the next decide
+                snapshot, predictions, prepared = None, {}, None
+                started = time.perf_counter()
+                snapshot, stats = take_snapshot(session, universe.events(), timeout=request_timeout, buffers=buffers)
+                predictions = strategy.predict_all(model, spec, snapshot.candlesticks)
+                prepared = cycle
+                conn.send((cycle, step, {'markets': len(snapshot.candlesticks), 'fetch': str(stats),
+                                         'seconds': time.perf_counter() - started}))
+            elif step == 'decide':
+                holdings, open_orders, can_buy = message[2:]
+                # no orders from a snapshot that isn't this cycle's
+                if prepared != cycle:
+                    conn.send((cycle, step, {'buys': [], 'sells': []}))
+                    continue
+                buys = strategy.buy_decisions(snapshot, holdings, predictions, open_orders) if can_buy else []
+                sells = strategy.sell_decisions(holdings, snapshot, predictions, open_orders)
+                conn.send((cycle, step, {'buys': buys, 'sells': sells}))
+        except Exception as e:
+            conn.send((cycle, step, {'error': repr(e)}))
+
+
+class Coordinator:
+    def __init__(self, shards=4, series=None, model_path=None, request_timeout=5):
+        self.series = list(dict.fromkeys(series or config.SERIES))
+        self.client = Client()
+        self.orders = OrderManager(self.client)
+        self.cycle = 0
+        # positions and order reconciliation run here while the workers fetch (and the orders are placed from here too,
+        # so that a cycle never waits on them for longer than ORDER_TIMEOUT)
+        self.pool = ThreadPoolExecutor(3)
+
+        model_path = model_path or config.MODEL_PATH
+        model, spec = load(model_path)
+        if isinstance(model, torch.jit.ScriptModule):
+            model = None
+        else:
+            model.share_memory()
+
+        # what a worker is started with, so one that dies can be started again for the same series
+        self.ctx = mp.get_context('spawn')
+        self.worker_args = (model, spec, model_path, request_timeout)
+        self.workers = [self._spawn(mine) for mine in assign(self.series, shards)]
+        # wait for every worker to have started (importing torch in a new process takes a while)
+        self._ask('ready', STARTUP_TIMEOUT, send=False)
+        print(f'{len(self.workers)} workers: ' + ', '.join(f'{len(w[2])} series' for w in self.workers))
+
+    # start a worker process for some series; returns (pipe, process, series)
+    def _spawn(self, series):
+        parent, child = self.ctx.Pipe()
+        process = self.ctx.Process(target=_worker, args=(child, series, *self.worker_args), daemon=True)
+        process.start()
+        return parent, process, series
+
+    # a worker that has died is started again for its series (it sits out the cycle while it starts up; its 'ready'
+    # message is thrown away like any other late answer)
+    def _restart(self, i, reason):
+        conn, process, series = self.workers[i]
+        print(f'worker for {series} died ({reason}), starting it again')
+        metrics.inc('shard_restarts_total')
+        conn.close()
+        if process.is_alive():
+            process.kill()
+        process.join(1)
+        self.workers[i] = self._spawn(series)
+
+    # send a step to every worker and collect the answers that arrive within timeout
+    # (a worker that is too slow is skipped for this cycle; its late answers are thrown away when they do arrive, and a
+    # worker that has died is skipped and restarted, so the other shards keep trading)
+    def _ask(self, step, timeout, *args, send=True):
+        asked = []
+        for i, (conn, process, _) in enumerate(self.workers):
+            if not process.is_alive():
+                self._restart(i, f'exit code {process.exitcode}')
+                continue
+            try:
+                if send:
+                    conn.send((step, self.cycle, *args))
+                asked.append(i)
+            except (BrokenPipeError, EOFError, OSError) as e:
+                self._restart(i, repr(e))
+
+        deadline = time.monotonic() + timeout
+        answers = []
+        for i in asked:
+            conn, _, series = self.workers[i]
+            try:
+                while conn.poll(max(0.0, deadline - time.monotonic())):
+                    cycle, answered, answer = conn.recv()
+                    if (cycle, answered) != (self.cycle, step):
+                        continue
+                    if 'error' in answer:
+                        print(f'worker for {series} failed: {answer["error"]}')
+                    else:
+                        answers.append(answer)
+                    break
+            except (BrokenPipeError, EOFError, OSError) as e:
+                self._restart(i, repr(e))
+        return answers
+
+    def run_cycle(self, can_buy=True):
+        self.cycle += 1
+        positions = self.pool.submit(self.client.get_positions)
+        reconciled = self.pool.submit(self.orders.reconcile)
+
+        prepared = self._ask('prepare', PREPARE_TIMEOUT)
+        for answer in prepared:
+            metrics.observe('shard_prepare_seconds', answer['seconds'])
+        holdings = positions.result(POSITIONS_TIMEOUT)
+        try:
+            reconciled.result(POSITIONS_TIMEOUT)
+        except Exception as e:
+            print(f'order reconcile failed: {e}')
+
+        decided = self._ask('decide', DECIDE_TIMEOUT, holdings, self.orders.view(), can_buy)
+        buys = [b for answer in decided for b in answer['buys']]
+        sells = [s for answer in decided for s in answer['sells']]
+
+        # the portfolio limits are checked across every shard at once
+        buys = RiskView(holdings, self.orders.open_orders(), config.MAX_EXPOSURE, config.MAX_POSITIONS).filter_buys(buys)
+        placing = [(key, 'buy', yes_ask, 1) for key, yes_ask in buys]
+        placing += [(key, 'sell', yes_offer, count) for key, yes_offer, count in sells]
+        try:
+            results = self.pool.submit(self.orders.place_many, placing).result(ORDER_TIMEOUT) if placing else []
+        except TimeoutError:
+            print(f'{len(placing)} orders timed out')
+            results = []
+
+        for (key, action, _, _), (status, text) in zip(placing, results):
+            print(f'{key} {"bought" if action == "buy" else "sold"}, status: {status if status is not None else text}')
+        print(f'{sum(a["markets"] for a in prepared)} markets from {len(prepared)}/{len(self.workers)} workers, '
+              f'{len(placing)} orders')
+        return results
+
+    # can_buy is the same testing switch as Decider's (False to only sell what is already held)
+    def run(self, cycle_seconds=60, can_buy=True):
+        if config.METRICS_PORT:
+            metrics.serve(config.METRICS_PORT)
+        while True:
+            # wait for the start of the next cycle, so the cycles don't drift with api latency
+            time.sleep(cycle_seconds - time.time() % cycle_seconds)
+            try:
+                with metrics.span('cycle'), metrics.profile(config.PROFILE_PATH):
+                    self.run_cycle(can_buy)
+            except TimeoutError:
+                metrics.inc('cycle_timeouts_total')
+                print('cycle timed out')
+            except Exception as e:
+                print(f'cycle failed: {e}')
+            if config.METRICS_PATH:
+                metrics.write(config.METRICS_PATH)
+
+    def stop(self):
+        for conn, process, _ in self.workers:
+            try:
+                conn.send(None)
+            except (BrokenPipeError, OSError):
+                pass
+            process.join(5)
+            if process.is_alive():
+                process.kill()
+        self.pool.shutdown()
+
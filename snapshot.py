@@ -0,0 +1,97 @@
+import time
+import fetcher
+import metrics
+from orderbook import OrderBook
+import config
+from candle_buffer import to_array
+
+# everything the decider needs to know about the markets it trades, fetched all at once at the start of a cycle
+# the decisions for a cycle are all made against the same snapshot, so they reflect the same minute the model saw
+
+class Snapshot:
+    def __init__(self, candlesticks, orderbooks, markets, taken_at):
+        # ticker -> the last candlesticks of the market, as a (candlesticks, fields) array oldest first, with one column
+        # per field of columnar.FIELDS (see candle_buffer.py)
+        self.candlesticks = candlesticks
+        # ticker -> the orderbook of the market (the 'orderbook' part of the api response)
+        self.orderbooks = orderbooks
+        # ticker -> the market record (the 'market' part of the api response)
+        self.markets = markets
+        self.taken_at = taken_at
+        # ticker -> the orderbook parsed once into an orderbook.OrderBook, which is what the trading rules read
+        self.books = {ticker: OrderBook.from_api(orderbook) for ticker, orderbook in orderbooks.items()}
+
+    def orderbook(self, ticker):
+        return self.orderbooks.get(ticker)
+
+    def book(self, ticker):
+        return self.books.get(ticker)
+
+    def market(self, ticker):
+        return self.markets.get(ticker)
+
+
+# the (series_ticker, ticker) of every market worth trading
+def traded_markets(events):
+    markets = []
+    for event in events:
+        for market in event['event']['markets']:
+            # if there is no volume, the market is stagnant and shouldn't be traded
+            if market['volume'] == 0:
+                continue
+            markets.append((event['event']['series_ticker'], market['ticker']))
+    return markets
+
+
+def _candlestick_url(series_ticker, ticker, start_ts, end_ts, period_interval=1):
+    return (f'{config.API_URL}/series/{series_ticker}/markets/{ticker}/candlesticks'
+            f'?start_ts={start_ts}&end_ts={end_ts}&period_interval={period_interval}')
+
+
+# fetch the candlesticks, orderbook and market record of every traded market concurrently over one pooled session
+# lookback is how many seconds of candlesticks to ask for and keep is how many of the last candlesticks to hold on to
+# a request that fails max_attempts times (e.g. times out) is left out of the snapshot rather than holding up the cycle
+# if buffers (candle_buffer.CandleBuffers) are given, only the minutes since each market's last candlestick are fetched
+# and appended to its buffer, instead of the whole lookback (and the buffers of markets that are no longer traded are dropped)
+def take_snapshot(session, events, lookback=14400 * 2, keep=59, max_workers=20, timeout=10, max_attempts=2, buffers=None):
+    markets = traded_markets(events)
+    end_ts = int(time.time())
+    if buffers is not None:
+        buffers.retain(ticker for _, ticker in markets)
+
+    urls = []
+    for series_ticker, ticker in markets:
+        start_ts = buffers.start_ts(ticker, end_ts) if buffers is not None else end_ts - lookback
+        urls.append(_candlestick_url(series_ticker, ticker, start_ts, end_ts))
+        urls.append(f'{config.API_URL}/markets/{ticker}/orderbook')
+        urls.append(f'{config.API_URL}/markets/{ticker}')
+
+    with metrics.span('snapshot_fetch'):
+        responses, stats = fetcher.fetch_all(session, urls, max_workers=max_workers, timeout=timeout, max_attempts=max_attempts)
+
+    with metrics.span('candle_parse'):
+        candlesticks, orderbooks, market_records = _parse(markets, responses, keep, buffers)
+    metrics.inc('markets_fetched_total', len(candlesticks))
+
+    return Snapshot(candlesticks, orderbooks, market_records, end_ts), stats
+
+
+# sort the responses of take_snapshot into candlesticks, orderbooks and market records (writing into the buffers)
+def _parse(markets, responses, keep, buffers):
+    candlesticks = {}
+    orderbooks = {}
+    market_records = {}
+    for i, (_, ticker) in enumerate(markets):
+        candles, orderbook, market = responses[3 * i:3 * i + 3]
+        if candles is not None and 'candlesticks' in candles:
+            if buffers is not None:
+                buffers[ticker].extend(candles['candlesticks'])
+                candlesticks[ticker] = buffers[ticker].array()
+            else:
+                # only trade on the last hour of data (i.e., the last 59 candlesticks)
+                candlesticks[ticker] = to_array(candles['candlesticks'][-keep:])
+        if orderbook is not None and 'orderbook' in orderbook:
+            orderbooks[ticker] = orderbook['orderbook']
+        if market is not None and 'market' in market:
+            market_records[ticker] = market['market']
+    return candlesticks, orderbooks, market_records
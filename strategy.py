@@ -0,0 +1,101 @@
+import metrics
+from columnar import FIELDS
+
+# the trading rules, kept apart from decider.py so they can be run anywhere (e.g. in the workers of sharded.py)
+# torch is only imported by predict_all, so importing the rules stays cheap
+# orders is anything with a has_open(ticker, action) method (an orders.OrderManager, or an orders.OpenOrders copy of one)
+# the snapshot's candlesticks are arrays with one column per field of columnar.FIELDS (see snapshot.py)
+
+# the column of the yes bid open, the last bid the rules compare the model's prediction with
+YES_BID_OPEN = list(FIELDS).index('yes_bid_open')
+
+# run the model once over every market at the same time, instead of once per market
+# returns a map of ticker -> the model's prediction, shared by the buy and sell logic
+# (the inputs are built with spec, the feature spec the model was trained with)
+def predict_all(model, spec, candlesticks):
+    # the inputs are built by the same code as the training data, one (markets, channels, window) batch for every market
+    with metrics.span('features'):
+        tickers, inputs = spec.build_markets(candlesticks)
+    if not tickers:
+        return {}
+
+    import torch
+    with metrics.span('model_forward'), torch.inference_mode():
+        outputs = model(torch.from_numpy(inputs)).view(-1).tolist()
+    metrics.inc('predictions_total', len(outputs))
+
+    return dict(zip(tickers, outputs))
+
+# a couple of safeguards to avoid buying in dangerous edge cases
+# the orderbook and market record come from the snapshot taken at the start of the cycle; the book is parsed once there
+# (snapshot.book, an orderbook.OrderBook) and every check below reads from it
+def verify_buyability(ticker, snapshot):
+    book = snapshot.book(ticker)
+    market = snapshot.market(ticker)
+    if book is None or market is None:
+        return False, None
+
+    # if there are no bids, don't buy because it may be
+    # impossible to sell later on
+    # for example, if the bot wants to buy a 1 cent conract, predicting it will go up 2 cents,
+    # it will never be able to sell, leading to a loss
+    if book.best_bid is None:
+        return False, None
+
+    # buy at the cheapest offer in the book (or the market's last price if nobody is offering)
+    yes_ask = book.best_ask if book.best_ask is not None else market['last_price']
+
+    # if the ask is less than the best bid + 2 cents, buy
+    if yes_ask < book.best_bid + 2:
+        return True, yes_ask
+    else:
+        return False, None
+    
+# a couple of safeguards to sell when a position is suffering
+# returns (sellable, price, count): sell count of the posn contracts held at price, where count is only as many as the
+# book will take above the price the position was bought at, and price is the lowest bid needed to fill all of them
+def verify_sellability(ticker, original_price, snapshot, posn=1):
+    book = snapshot.book(ticker)
+    if book is None or book.best_bid is None or original_price >= 100:
+        return False, None, 0
+
+    # how many contracts are bid for more than the price at the time you purchased the position
+    count = min(posn, book.depth_through('bid', original_price + 1))
+    if count <= 0:
+        return False, None, 0
+    return True, book.fill_price('sell', count), count
+
+# decide which markets to buy, without placing any orders
+# returns a list of (ticker, yes_ask) for every market that should be bought
+def buy_decisions(snapshot, holdings, predictions, orders):
+    buys = []
+    for key, value in snapshot.candlesticks.items():
+        # get the model's prediction for this market (markets with no data don't have one)
+        if key in predictions:
+            # if the last bid is less than the model's prediction, buy
+            # (unless a buy placed in an earlier cycle is still waiting, so orders don't pile up on the same market)
+            if value[-1, YES_BID_OPEN] < predictions[key] and not orders.has_open(key, 'buy'):
+                # verify buyability first, using logic from verify_buyability
+                buyable, yes_ask = verify_buyability(key, snapshot)
+                if buyable:
+                    buys.append((key, yes_ask))
+    return buys
+
+# decide which positions to sell, without placing any orders
+# returns a list of (ticker, yes_offer, count) for every position that should be sold
+def sell_decisions(holdings, snapshot, predictions, orders):
+    sells = []
+    for key, value in snapshot.candlesticks.items():
+        # the model's prediction for whether or not the price will go down
+        if key in predictions:
+            # if you currently own the position and its last bid is greater than the model's prediction, sell
+            if key in holdings and value[-1, YES_BID_OPEN] > predictions[key]:
+
+                # verify sellability first, using logic from verify_sellability
+                sellable, yes_offer, count = verify_sellability(key, holdings[key].price, snapshot, holdings[key].posn)
+
+                # if the position is sellable and not already being sold, sell
+                # (a sell order rests for 3 minutes, which is the cooldown between sells of the same position)
+                if sellable and not orders.has_open(key, 'sell'):
+                    sells.append((key, yes_offer, count))
+    return sells
@@ -0,0 +1,170 @@
+import os
+import csv
+import json
+import math
+import time
+import argparse
+import itertools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# train many KalshiCNN configurations in parallel, one process per configuration
+# the dataset is packed once up front (see process_data.pack), so every worker memory-maps the same x.npy and the
+# operating system keeps a single copy of it in memory, however many workers there are
+#
+# configurations are weeded out by successive halving: every configuration is trained for min_epochs, the best 1/eta
+# of them carry on (from their checkpoints) to min_epochs * eta epochs, the best 1/eta of those to min_epochs * eta^2,
+# and so on up to max_epochs
+# the leaderboard (leaderboard.csv in the output directory) has the validation loss and inference latency of every config
+
+# the settings that can be swept, and their defaults (the original model)
+DEFAULTS = {'lr': 1e-3, 'batch_size': 1024, 'widths': [32, 64], 'kernels': [5, 3], 'hidden': 50}
+
+
+# every combination of the given values, e.g. grid({'lr': [1e-3, 3e-4], 'hidden': [50]}) is two configs
+def grid(space):
+    names = list(space)
+    return [dict(DEFAULTS, **dict(zip(names, values))) for values in itertools.product(*(space[n] for n in names))]
+
+
+def config_name(config):
+    return '_'.join(f'{key}={"-".join(map(str, value)) if isinstance(value, list) else value}' for key, value in config.items())
+
+
+# train one configuration up to `epochs` epochs (carrying on from its checkpoint) in a worker process
+# returns the row of the leaderboard for it
+def _train_config(name, config, data_path, out_dir, epochs, threads, channels, patience, seed):
+    import torch
+    import nn
+    import inference
+
+    torch.manual_seed(seed)
+    model_path = os.path.join(out_dir, name + '.pth')
+    checkpoint = os.path.join(out_dir, name + '.ckpt')
+    started = time.perf_counter()
+    nn.train(data_path, model_path, epochs=epochs, batch_size=config['batch_size'], lr=config['lr'], threads=threads,
+             patience=patience, checkpoint=checkpoint, resume=True, channels=channels, show_progress=False,
+             arch={'widths': config['widths'], 'kernels': config['kernels'], 'hidden': config['hidden']})
+    train_seconds = time.perf_counter() - started
+
+    state = torch.load(checkpoint, weights_only=True)['state']
+    best = min(state['history'], key=lambda h: h['val_loss'])
+    params = sum(p.numel() for p in inference.load_model(model_path).parameters())
+    # the latency is measured once the sweep is over, so it isn't skewed by the other workers
+    return {'name': name, 'epochs': state['epoch'] + 1, 'val_loss': best['val_loss'], 'val_mae': best['val_mae'],
+            'latency_ms': None, 'params': params, 'train_seconds': train_seconds, **config}
+
+
+# the epochs each rung of successive halving trains to
+def rungs(min_epochs, max_epochs, eta):
+    out = [min_epochs]
+    while out[-1] * eta < max_epochs:
+        out.append(out[-1] * eta)
+    if out[-1] < max_epochs:
+        out.append(max_epochs)
+    return out
+
+
+# the configs that reached the furthest rung come first, then the lowest val_loss (not the most epochs: a config that
+# stopped early on patience still made its rung)
+def write_leaderboard(rows, path):
+    rows = sorted(rows, key=lambda r: (-r['rung'], r['val_loss']))
+    if not rows:
+        return rows
+    with open(path + '.tmp', 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+        writer.writeheader()
+        for row in rows:
+            writer.writerow({k: json.dumps(v) if isinstance(v, list) else v for k, v in row.items()})
+    os.replace(path + '.tmp', path)
+    return rows
+
+
+# run the sweep; configs is a list of dicts of the settings in DEFAULTS
+# returns the leaderboard rows, best first (the configs that reached the furthest rung come first)
+def sweep(configs, data_path='../large_files/dataset', out_dir='sweep', workers=None, min_epochs=5, max_epochs=80, eta=3,
+          channels=None, patience=20, seed=0):
+    import features
+    import process_data
+
+    os.makedirs(out_dir, exist_ok=True)
+    workers = workers or min(len(configs), os.cpu_count() or 1)
+    # split the cores between the workers so they don't fight over them
+    threads = max(1, (os.cpu_count() or 1) // workers)
+
+    # pack the dataset (and fit its feature stats) before any worker starts, so they all just map the same files
+    process_data.KalshiDataset(data_path, packed=True, spec=features.fit_dataset(data_path, channels))
+
+    configs = {config_name(c): c for c in configs}
+    alive = list(configs)
+    results = {}
+    leaderboard = os.path.join(out_dir, 'leaderboard.csv')
+
+    # spawn rather than fork: forking a process that has already started torch's threads can deadlock
+    with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+        for rung, epochs in enumerate(rungs(min_epochs, max_epochs, eta)):
+            started = time.perf_counter()
+            futures = {pool.submit(_train_config, name, configs[name], data_path, out_dir, epochs, threads, channels,
+                                   patience, seed): name for name in alive}
+            for future in as_completed(futures):
+                name = futures[future]
+                try:
+                    results[name] = dict(future.result(), rung=rung)
+                except Exception as e:
+                    print(f'{name} failed: {e}')
+                    alive.remove(name)
+            if not alive:
+                break
+            rows = write_leaderboard(list(results.values()), leaderboard)
+            print(f'rung {rung} ({epochs} epochs, {len(futures)} configs) took {time.perf_counter() - started:.1f}s, '
+                  f'best {rows[0]["name"]} val {rows[0]["val_loss"]:.4f}')
+
+            # the best 1/eta go on to the next rung
+            alive = sorted(alive, key=lambda n: results[n]['val_loss'])[:max(1, math.ceil(len(alive) / eta))]
+
+    # the inference latency of every model, one at a time on an otherwise idle machine (a batch of 60 markets, like the decider)
+    import torch
+    import inference
+    torch.set_num_threads(os.cpu_count() or 1)
+    for name, row in results.items():
+        _, batch_time = inference.benchmark(os.path.join(out_dir, name + '.pth'), runs=100)
+        row['latency_ms'] = batch_time * 1000
+    return write_leaderboard(list(results.values()), leaderboard)
+
+
+def _ints(value):
+    return [int(v) for v in value.split(',')]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='train many KalshiCNN configurations in parallel')
+    parser.add_argument('--data', default='../large_files/dataset')
+    parser.add_argument('--out', default='sweep')
+    parser.add_argument('--configs', help='a json file with a list of configs (instead of the grid below)')
+    parser.add_argument('--lr', type=float, nargs='+', default=[DEFAULTS['lr']])
+    parser.add_argument('--batch-size', type=int, nargs='+', default=[DEFAULTS['batch_size']])
+    parser.add_argument('--widths', type=_ints, nargs='+', default=[DEFAULTS['widths']], help='e.g. 32,64 16,32,64')
+    parser.add_argument('--kernels', type=_ints, nargs='+', default=[DEFAULTS['kernels']], help='e.g. 5,3 7,5,3')
+    parser.add_argument('--hidden', type=int, nargs='+', default=[DEFAULTS['hidden']])
+    parser.add_argument('--channels', nargs='*', default=None, help='the input channels (see features.CHANNELS)')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--min-epochs', type=int, default=5)
+    parser.add_argument('--max-epochs', type=int, default=80)
+    parser.add_argument('--eta', type=int, default=3, help='keep the best 1/eta of the configs at every rung')
+    parser.add_argument('--patience', type=int, default=20)
+    args = parser.parse_args()
+
+    if args.configs:
+        with open(args.configs) as f:
+            configs = [dict(DEFAULTS, **c) for c in json.load(f)]
+    else:
+        # widths and kernels go together (one kernel per convolution)
+        configs = [c for c in grid({'lr': args.lr, 'batch_size': args.batch_size, 'widths': args.widths,
+                                    'kernels': args.kernels, 'hidden': args.hidden})
+                   if len(c['widths']) == len(c['kernels'])]
+
+    rows = sweep(configs, args.data, args.out, args.workers, args.min_epochs, args.max_epochs, args.eta, args.channels,
+                 args.patience)
+    for row in rows[:10]:
+        print(f'{row["name"]}: {row["epochs"]} epochs, val {row["val_loss"]:.4f}, mae {row["val_mae"]:.3f}, '
+              f'{row["latency_ms"]:.3f}ms per batch of 60')
@@ -0,0 +1,128 @@
+import time
+import threading
+from datetime import datetime, timezone
+from urllib.parse import urlencode
+from concurrent.futures import ThreadPoolExecutor
+import fetcher
+import config
+
+# the events (and their markets) the bot trades, found from a list of series instead of hard-coded event tickers
+# every series is listed with GET /events?series_ticker=...&with_nested_markets=true, one page of up to 200 events at a
+# time, so a series costs one or two requests however many days it has; the series are listed concurrently
+#
+# MarketUniverse keeps the open events in memory for ttl seconds. An event drops out once all of its markets have
+# closed, and a new day's events are picked up on the next refresh. So the bot rolls over to tomorrow's markets by
+# itself, without a new list of tickers every morning.
+# the events come back in the same {'event': {...}} shape as GET /events/{event_ticker}, so snapshot.traded_markets
+# and get_data.get_candlesticks work with them as they are
+
+PAGE_LIMIT = 200
+
+
+# turn the api's timestamp format into a unix timestamp
+def to_timestamp(ts):
+    # some times have microseconds; get rid of the microseconds
+    if '.' in ts:
+        ts = ts.split('.')[0] + 'Z'
+
+    # convert the time to a timestamp (the format given by the api is not appropriate for api calls - yes, this is odd)
+    return int(datetime.strptime(ts, "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=timezone.utc).timestamp())
+
+
+# when the last market of an event closes
+def closes_at(event):
+    return max((to_timestamp(m['close_time']) for m in event['event']['markets']), default=0)
+
+
+# whether every market of an event has closed
+def is_closed(event, now=None):
+    return closes_at(event) <= (time.time() if now is None else now)
+
+
+# every event of one series (with its markets), following the cursor
+# status can be 'open', 'closed', 'settled' (or None for all of them)
+def list_events(session, series_ticker, status=None, limiter=None, stats=None, timeout=10):
+    limiter = limiter if limiter is not None else fetcher.RateLimiter()
+    stats = stats if stats is not None else fetcher.FetchStats()
+    params = {'series_ticker': series_ticker, 'with_nested_markets': 'true', 'limit': PAGE_LIMIT}
+    if status is not None:
+        params['status'] = status
+
+    events = []
+    while True:
+        page = fetcher.fetch_json(session, f'{config.API_URL}/events?{urlencode(params)}', limiter, stats, timeout=timeout)
+        if page is None:
+            raise RuntimeError(f'could not list the events of {series_ticker}')
+        events.extend({'event': event} for event in page.get('events', []))
+        if not page.get('cursor'):
+            return events
+        params['cursor'] = page['cursor']
+
+
+# every event of many series at once; returns series_ticker -> list of events (a series that fails is left out)
+def discover(session, series, status=None, max_workers=10, limiter=None, stats=None):
+    limiter = limiter if limiter is not None else fetcher.RateLimiter()
+    stats = stats if stats is not None else fetcher.FetchStats()
+
+    def fetch(series_ticker):
+        try:
+            return series_ticker, list_events(session, series_ticker, status, limiter, stats)
+        except RuntimeError as e:
+            print(e)
+            return series_ticker, None
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(series)))) as pool:
+        return {s: events for s, events in pool.map(fetch, dict.fromkeys(series)) if events is not None}
+
+
+class MarketUniverse:
+    # series is a list of series tickers (config.SERIES by default); ttl is how long the open events are reused for
+    def __init__(self, session, series=None, ttl=None, max_workers=10):
+        self.session = session
+        self.series = list(dict.fromkeys(series or config.SERIES))
+        self.ttl = config.UNIVERSE_TTL if ttl is None else ttl
+        self.max_workers = max_workers
+        self._events = []
+        # event_ticker -> event, and market ticker -> event_ticker
+        self._by_event = {}
+        self._by_market = {}
+        self.refreshed_at = 0.0
+        # when the first of the cached events closes
+        self.next_close = 0
+        self.lock = threading.Lock()
+
+    # list the open events of every series again
+    def refresh(self):
+        found = discover(self.session, self.series, status='open', max_workers=self.max_workers)
+        now = time.time()
+        with self.lock:
+            # a series that couldn't be listed keeps the events it had
+            kept = [e for e in self._events if e['event']['series_ticker'] not in found]
+            events = kept + [e for s in self.series for e in found.get(s, [])]
+            self._set(events, now)
+        return self._events
+
+    def _set(self, events, now):
+        closes = [(closes_at(e), e) for e in events]
+        self._events = [e for close, e in closes if close > now]
+        self.next_close = min((close for close, _ in closes if close > now), default=float('inf'))
+        self._by_event = {e['event']['event_ticker']: e for e in self._events}
+        self._by_market = {m['ticker']: t for t, e in self._by_event.items() for m in e['event']['markets']}
+        self.refreshed_at = now
+
+    # the open events, listed again if the cache is older than ttl or one of the events has closed since it was listed
+    def events(self, now=None):
+        now = time.time() if now is None else now
+        with self.lock:
+            stale = now - self.refreshed_at > self.ttl or now >= self.next_close
+        if stale:
+            return self.refresh()
+        return self._events
+
+    def event(self, event_ticker):
+        return self._by_event.get(event_ticker)
+
+    # the event a market belongs to
+    def event_of(self, ticker):
+        event_ticker = self._by_market.get(ticker)
+        return self._by_event.get(event_ticker) if event_ticker else None